@@ -0,0 +1,83 @@
+import os
+import hashlib
+from os import path
+from collections import OrderedDict
+import numpy as np
+
+
+##  Content hash of a file
+def file_hash(filename):
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1<<20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+##  Cache of featurized inputs & raw logits
+class PredictionCache:
+    """
+    LRU cache for Predictor.
+
+    Entries are dicts of numpy arrays (featurized graph with margins,
+    residue info and raw logits), keyed by the hashes of the structure
+    file & the parameter file and the HyperParam values.
+
+    Parameters
+    ----------
+    maxsize : int
+        Maximum number of entries kept in memory.
+    dir_cache : str
+        Directory of the on-disk tier (optional). Entries are stored as
+        .npz files and are loaded into memory on access.
+    """
+
+    def __init__(self, maxsize: int=32, dir_cache: str=None):
+        self.maxsize = maxsize
+        self.dir_cache = dir_cache
+        self.data = OrderedDict()
+        self.hits, self.misses = 0, 0
+        if dir_cache is not None:
+            os.makedirs(dir_cache, exist_ok=True)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data or (self.dir_cache is not None and path.isfile(self._file(key)))
+
+    def _file(self, key):
+        return path.join(self.dir_cache, key + '.npz')
+
+    def key(self, pdb, param_hash, hypara):
+        return hashlib.sha256((file_hash(pdb) + param_hash + repr(hypara)).encode()).hexdigest()
+
+    def get(self, key):
+        if key in self.data:
+            self.data.move_to_end(key)
+            self.hits += 1
+            return self.data[key]
+        if self.dir_cache is not None and path.isfile(self._file(key)):
+            with np.load(self._file(key), allow_pickle=False) as f:
+                entry = {k:f[k] for k in f.files}
+            self._store(key, entry)
+            self.hits += 1
+            return entry
+        self.misses += 1
+        return None
+
+    def put(self, key, entry):
+        self._store(key, entry)
+        if self.dir_cache is not None:
+            tmpfile = self._file(key) + '.{:d}.tmp.npz'.format(os.getpid())
+            np.savez(tmpfile, **entry)
+            os.replace(tmpfile, self._file(key))
+
+    def _store(self, key, entry):
+        self.data[key] = entry
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def clear(self):
+        self.data.clear()
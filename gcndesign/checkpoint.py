@@ -0,0 +1,114 @@
+import os
+import copy
+import torch
+from concurrent.futures import ThreadPoolExecutor
+from .weights import params_dict
+
+
+##  Copy of the tensors in a (nested) state dict on cpu
+def snapshot(state):
+    if isinstance(state, torch.Tensor):
+        return state.detach().to('cpu', copy=True)
+    if isinstance(state, dict):
+        return {k: snapshot(v) for k, v in state.items()}
+    if isinstance(state, (list, tuple)):
+        return type(state)(snapshot(v) for v in state)
+    return copy.deepcopy(state)
+
+
+##  Epochs kept by the retention policy
+def retained(losses, keep_last=None, keep_best=False, keep_every=None):
+    """
+    losses: {epoch: validation loss}. Returns the set of epochs to be kept:
+    the last 'keep_last' epochs, the best one by the validation loss &
+    every 'keep_every'-th epoch. All epochs are kept if keep_last is None.
+    """
+    epochs = sorted(losses)
+    if keep_last is None:
+        return set(epochs)
+    keep = set(epochs[-keep_last:]) if keep_last > 0 else set()
+    if keep_best and epochs:
+        keep.add(min(epochs, key=lambda e: (losses[e], -e)))
+    if keep_every:
+        keep.update(e for e in epochs if e % keep_every == 0)
+    return keep
+
+
+##  Checkpoints written in background with a retention policy
+class CheckpointWriter:
+    """
+    Writes the parameter file ('{prefix}-{epoch:03d}.pt') & the checkpoint
+    ('{prefix}-{epoch:03d}.ckp', with the optimizer & scheduler states) of
+    each epoch. The states are copied to cpu by save() and the files are
+    written by a background thread while the training continues; at most
+    one write is in flight (save() waits for the previous one). Files are
+    written under a temporary name & renamed, and files of the epochs not
+    retained (see retained()) are removed after each write. Only the files
+    written by this writer are removed. The directory of the prefix is
+    checked when the writer is created, and errors of a write are raised
+    by the next save() or by close() (which must be called at the end).
+
+    Parameters
+    ----------
+    prefix : str
+        Prefix of the files (InputSource.param_prefix).
+    keep_last : int
+        Number of the latest epochs kept (None for all epochs).
+    keep_best : bool
+        Keep the epoch of the lowest validation loss.
+    keep_every : int
+        Keep every k-th epoch.
+    """
+
+    def __init__(self, prefix, keep_last=None, keep_best=False, keep_every=None):
+        assert keep_last is None or keep_last >= 0, "keep_last must be >= 0."
+        dir_out = os.path.dirname(os.path.abspath(prefix))
+        assert os.path.isdir(dir_out), "Directory {:s} for the parameter files was not found.".format(dir_out)
+        assert os.access(dir_out, os.W_OK), "Directory {:s} for the parameter files is not writable.".format(dir_out)
+        self.prefix = prefix
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.keep_every = keep_every
+        self.losses = {}
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.future = None
+
+    def files(self, epoch):
+        return ["{}-{:03d}.pt".format(self.prefix, epoch), "{}-{:03d}.ckp".format(self.prefix, epoch)]
+
+    def save(self, epoch, model, optimizer, scheduler, hypara, loss_train, loss_valid):
+        self.wait()
+        state_dict = snapshot(model.state_dict())
+        params = params_dict(model, state_dict)
+        ckp = {'epoch': epoch,
+               'model_state_dict': state_dict,
+               'optimizer_state_dict': snapshot(optimizer.state_dict()),
+               'scheduler_state_dict': snapshot(scheduler.state_dict()),
+               'loss': loss_train,
+               'loss_valid': loss_valid,
+               'hyperparams': copy.deepcopy(hypara)}
+        self.future = self.executor.submit(self._write, epoch, params, ckp, loss_valid)
+
+    def _write(self, epoch, params, ckp, loss_valid):
+        for obj, file in zip((params, ckp), self.files(epoch)):
+            torch.save(obj, file + '.tmp')
+            os.replace(file + '.tmp', file)
+        self.losses[epoch] = loss_valid
+        keep = retained(self.losses, self.keep_last, self.keep_best, self.keep_every)
+        for e in [e for e in self.losses if e not in keep]:
+            for file in self.files(e):
+                if os.path.isfile(file):
+                    os.remove(file)
+            del self.losses[e]
+
+    def wait(self):
+        # errors of the background write are raised here
+        if self.future is not None:
+            future, self.future = self.future, None
+            future.result()
+
+    def close(self):
+        try:
+            self.wait()
+        finally:
+            self.executor.shutdown()
@@ -0,0 +1,50 @@
+import json
+from os import path
+from urllib import request, error
+
+# default address of the prediction server
+default_address = 'localhost:8787'
+
+
+##  Client of the prediction server (no torch import)
+class PredictionClient:
+    def __init__(self, address: str=default_address, timeout: float=None):
+        self.url = 'http://' + address
+        self.timeout = timeout
+
+    def _request(self, route, query=None):
+        data = json.dumps(query).encode() if query is not None else None
+        req = request.Request(self.url + route, data=data, headers={'Content-Type': 'application/json'})
+        try:
+            with request.urlopen(req, timeout=self.timeout) as res:
+                return json.loads(res.read())
+        except error.HTTPError as e:
+            raise RuntimeError(json.loads(e.read()).get('error', str(e)))
+
+    def alive(self, timeout: float=0.5):
+        try:
+            with request.urlopen(self.url + '/stats', timeout=timeout) as res:
+                return res.status == 200
+        except (error.URLError, OSError):
+            return False
+
+    def stats(self):
+        return self._request('/stats')
+
+    def ignored_options(self, options: dict):
+        # options (e.g. {'param_in': absolute path}) differing from the model settings of the server
+        settings = self.stats().get('settings', {})
+        return [opt for opt, value in options.items() if value != settings.get(opt)]
+
+    def predict_logit(self, pdb: str, as_dict=False):
+        res = self._request('/logits', {'pdb': path.abspath(pdb)})
+        return [dict(zip(res['i2aa'], l)) for l in res['logits']] if as_dict else res['logits']
+
+    def predict(self, pdb: str, temperature: float=1.0):
+        res = self._request('/predict', {'pdb': path.abspath(pdb), 'temperature': temperature})
+        return [tuple(v) for v in res['predict']]
+
+    def make_resfile(self, pdb: str, temperature: float=1.0, prob_cut: float=0.8, unused=None):
+        res = self._request('/resfile', {'pdb': path.abspath(pdb), 'temperature': temperature,
+                                         'prob_cut': prob_cut, 'unused': unused})
+        return res['resfile']
@@ -1,12 +1,18 @@
+import os
 import sys
+import json
+import time
+import shutil
+import tempfile
+import weakref
 from os import path
+from glob import glob
+from multiprocessing import Pool
 import torch
 from torch.utils.data import Dataset
 import numpy as np
-from pandas import Series as series
 from .pdbutil import ProteinBackbone as pdb
 from .hypara import HyperParam
-from tqdm import tqdm
 
 # Int code of amino-acid types
 mapped = {'A': 0, 'C': 1, 'D': 2, 'E': 3, 'F': 4,
@@ -19,9 +25,36 @@ three2one = {'ALA': 'A', 'CYS': 'C', 'ASP': 'D', 'GLU':'E', 'PHE': 'F',
              'MET': 'M', 'ASN': 'N', 'PRO': 'P', 'GLN': 'Q', 'ARG': 'R',
              'SER': 'S', 'THR': 'T', 'VAL': 'V', 'TRP': 'W', 'TYR': 'Y'}
 
+##  Chain-break mask (vectorized)
+def chainbreak_mask(bb, hypara):
+    mask = np.ones((len(bb), 1), dtype=np.bool)
+    d1 = np.sqrt(np.sum((bb[:,0,:] - bb[:,1,:])**2, axis=1))
+    d2 = np.sqrt(np.sum((bb[:,1,:] - bb[:,2,:])**2, axis=1))
+    d3 = np.sqrt(np.sum((bb[:-1,2,:] - bb[1:,0,:])**2, axis=1))
+    mask[(d1 > hypara.dist_chbreak) | (d2 > hypara.dist_chbreak)] = 0
+    mask[:-1][d3 > hypara.dist_chbreak] = 0
+    mask[1:][d3 > hypara.dist_chbreak] = 0
+    return mask
+
+
+##  Edge features for neighbor list (vectorized), (naa, nneighbor, 36)
+def edge_features(bb, nn, mask, hypara):
+    edge = np.sqrt(
+        np.sum((bb[:,np.newaxis,:,np.newaxis,:] - bb[nn][:,:,np.newaxis,:,:])**2, axis=4)
+    ).reshape(nn.shape[0], nn.shape[1], -1)
+    edge = (edge - hypara.dist_mean) / hypara.dist_var
+    edge[~mask[:,0]] = 0
+    return edge
+
+
 ##  PDB data
-def pdb2input(filename, hypara):
-    bb = pdb(file=filename)
+def pdb2input(filename, hypara, legacy=False, sparse=False):
+    if isinstance(filename, pdb):
+        # already parsed structure (copied, since atoms are added below)
+        bb = pdb(copyfrom=filename)
+        bb.coord, bb.exists = bb.coord.copy(), bb.exists.copy()
+    else:
+        bb = pdb(file=filename)
     # add atoms
     bb.addCB(force=True)
     bb.addH(force=True)
@@ -38,65 +71,243 @@ def pdb2input(filename, hypara):
     node[0, 0:2] = 0
     node[-1, 2:] = 0
     # mask
-    mask = np.ones((len(bb), 1), dtype=np.bool)
-    for iaa in range(len(bb)):
-        d1 = np.sqrt(np.sum((bb[iaa,0,:] - bb[iaa,1,:])**2, axis=0))
-        d2 = np.sqrt(np.sum((bb[iaa,1,:] - bb[iaa,2,:])**2, axis=0))
-        if d1 > hypara.dist_chbreak or d2 > hypara.dist_chbreak: mask[iaa] = 0
-    for iaa in range(len(bb)-1):
-        d3 = np.sqrt(np.sum((bb[iaa,2,:] - bb[iaa+1,0,:])**2, axis=0))
-        if d3 > hypara.dist_chbreak: mask[iaa], mask[iaa+1] = 0, 0
+    if legacy:
+        mask = np.ones((len(bb), 1), dtype=np.bool)
+        for iaa in range(len(bb)):
+            d1 = np.sqrt(np.sum((bb[iaa,0,:] - bb[iaa,1,:])**2, axis=0))
+            d2 = np.sqrt(np.sum((bb[iaa,1,:] - bb[iaa,2,:])**2, axis=0))
+            if d1 > hypara.dist_chbreak or d2 > hypara.dist_chbreak: mask[iaa] = 0
+        for iaa in range(len(bb)-1):
+            d3 = np.sqrt(np.sum((bb[iaa,2,:] - bb[iaa+1,0,:])**2, axis=0))
+            if d3 > hypara.dist_chbreak: mask[iaa], mask[iaa+1] = 0, 0
+    else:
+        mask = chainbreak_mask(bb, hypara)
     # edge features
-    edgemat = np.zeros((len(bb), len(bb), 36), dtype=np.float)
-    adjmat = np.zeros((len(bb), len(bb), 1), dtype=np.bool)
     nn = bb.get_nearestN(hypara.nneighbor, atomtype='CB')
-    for iaa in range(len(bb)):
-        adjmat[iaa, nn[iaa]] = True
-        #####
-        if(mask[iaa] == False): continue
-        #####
-        for i in nn[iaa]:
-            edgemat[iaa, i] = np.sqrt(
-                np.sum((bb[iaa,:,np.newaxis,:] - bb[i,np.newaxis,:,:])**2, axis=2)
-            ).reshape(-1)
-            edgemat[iaa, i] = (edgemat[iaa, i] - hypara.dist_mean) / hypara.dist_var
+    if sparse:
+        # neighbor list (naa, nneighbor) & edge features (naa, nneighbor, 36)
+        adjmat = np.sort(nn, axis=1)
+        edgemat = edge_features(bb, adjmat, mask, hypara)
+    elif legacy:
+        edgemat = np.zeros((len(bb), len(bb), 36), dtype=np.float)
+        adjmat = np.zeros((len(bb), len(bb), 1), dtype=np.bool)
+        for iaa in range(len(bb)):
+            adjmat[iaa, nn[iaa]] = True
+            #####
+            if(mask[iaa] == False): continue
+            #####
+            for i in nn[iaa]:
+                edgemat[iaa, i] = np.sqrt(
+                    np.sum((bb[iaa,:,np.newaxis,:] - bb[i,np.newaxis,:,:])**2, axis=2)
+                ).reshape(-1)
+                edgemat[iaa, i] = (edgemat[iaa, i] - hypara.dist_mean) / hypara.dist_var
+    else:
+        edgemat = np.zeros((len(bb), len(bb), 36), dtype=np.float)
+        adjmat = np.zeros((len(bb), len(bb), 1), dtype=np.bool)
+        rows = np.arange(len(bb))[:,np.newaxis]
+        adjmat[rows, nn] = True
+        edgemat[rows, nn] = edge_features(bb, nn, mask, hypara)
     # label
     res = bb.resname
-    aa1 = series(res).map(lambda x: three2one.get(x,'X'))
-    label = np.array(aa1.map(lambda x: mapped.get(x,-1)), dtype=np.int)
+    aa1 = [three2one.get(x,'X') for x in res]
+    label = np.array([mapped.get(x,-1) for x in aa1], dtype=np.int)
     label = label.reshape(label.shape[0], 1)
     mask = mask * ~(label == -1)
     # return
     return node, edgemat, adjmat, label, mask, aa1
 
 
+##  Write CSV data (written under a temporary name & renamed, so that an
+##  existing outfile is always complete)
+def write_csv(outfile, node, edge, nnidx, label, mask, aa1):
+    tmpfile = outfile + '.{:d}.tmp'.format(os.getpid())
+    with open(tmpfile, 'w') as f:
+        for iaa in range(len(node)):
+            feature = ','.join(map(str, np.round(node[iaa], decimals=5)))
+            f.write("NODE,%d,%s,%s,%d,%d\n" % (iaa, feature, aa1[iaa], label[iaa], mask[iaa]))
+        for iaa in range(len(node)):
+            for i in range(nnidx.shape[1]):
+                feature = ','.join(map(str, np.round(edge[iaa,i], decimals=5)))
+                f.write("EDGE,%d,%d,%s\n" % (iaa, nnidx[iaa,i], feature))
+    os.replace(tmpfile, outfile)
+
+
+##  Binary shard format
+#  <prefix>.bin : packed records of (node, edge, nnidx, label, mask, aa1) with margins
+#  <prefix>.idx : JSON index of record names, byte offsets & lengths
+shard_version = 1
+
+def shard_layout(length, nneighbor):
+    fields = (('node', np.float32, (length, 6)),
+              ('edge', np.float32, (length, nneighbor, 36)),
+              ('nnidx', np.int32, (length, nneighbor)),
+              ('label', np.int8, (length,)),
+              ('mask', np.bool_, (length,)),
+              ('aa1', 'S1', (length,)))
+    layout, size = [], 0
+    for name, dtype, shape in fields:
+        layout.append((name, dtype, shape, size))
+        size += -(-int(np.prod(shape)) * np.dtype(dtype).itemsize // 16) * 16
+    return layout, size
+
+
+def read_shard_index(idxfile):
+    with open(idxfile, 'r') as f:
+        index = json.load(f)
+    assert index.get('format') == 'gcndesign-shard', "{:s} is not a shard index file.".format(idxfile)
+    assert index.get('version') == shard_version, "Unsupported shard version in {:s}.".format(idxfile)
+    return index
+
+
+class ShardWriter:
+    def __init__(self, prefix, hypara):
+        self.prefix = prefix
+        self.nneighbor = hypara.nneighbor
+        self.file = open(prefix + '.bin', 'wb')
+        self.entries = []
+        self.offset = 0
+    def __len__(self):
+        return len(self.entries)
+    def write(self, name, node, edge, nnidx, label, mask, aa1):
+        node, edge, nnidx, label, mask = add_margin(node, edge, nnidx, label, mask, self.nneighbor)
+        data = {'node':node, 'edge':edge, 'nnidx':nnidx, 'label':label[:,0], 'mask':mask[:,0],
+                'aa1':['X'] + list(aa1) + ['X']}
+        layout, size = shard_layout(len(node), self.nneighbor)
+        record = bytearray(size)
+        for field, dtype, shape, offset in layout:
+            val = np.ascontiguousarray(data[field], dtype=dtype).tobytes()
+            record[offset:offset+len(val)] = val
+        self.file.write(record)
+        self.entries.append({'name':name, 'offset':self.offset, 'length':len(node)})
+        self.offset += size
+    def close(self):
+        self.file.close()
+        # index is written last (& renamed), so that a shard without index is incomplete
+        with open(self.prefix + '.idx.tmp', 'w') as f:
+            json.dump({'format':'gcndesign-shard', 'version':shard_version,
+                       'nneighbor':self.nneighbor, 'entries':self.entries}, f)
+        os.replace(self.prefix + '.idx.tmp', self.prefix + '.idx')
+
+
+##  Id of an input structure (name of the output without extension & '.gz')
+def entry_id(pdb):
+    return path.splitext(path.basename(pdb[:-3] if pdb.endswith('.gz') else pdb))[0]
+
+
+##  Preprocessing of a single structure (worker)
+def preprocess_one(task):
+    pdb, dir_out, format, hypara = task
+    id = entry_id(pdb)
+    try:
+        node, edge, nnidx, label, mask, aa1 = pdb2input(pdb, hypara, sparse=True)
+        if format == 'csv':
+            outfile = dir_out + '/' + id + '.csv'
+            write_csv(outfile, node, edge, nnidx, label, mask, aa1)
+            return pdb, 'done', '{:s}\t{:d}'.format(outfile, len(node)), None
+    except Exception as e:
+        return pdb, 'failed', '{:s}: {:s}'.format(type(e).__name__, str(e)).replace('\n', ' '), None
+    return pdb, 'done', id, (node.astype(np.float32), edge.astype(np.float32), nnidx, label, mask, list(aa1))
+
+
 ##  Preprocessing
-def Preprocessing(file_list: str, dir_out: str='./', hypara=HyperParam()):
+def Preprocessing(file_list: str, dir_out: str='./', hypara=HyperParam(), format: str='csv', shard_size: int=1000,
+                  nworkers: int=1, chunksize: int=8, resume: bool=False, retry_failed: bool=False):
+    assert format in ('csv', 'shard'), "Unknown output format {:s}.".format(format)
     pdbs = open(file_list, 'r').read().splitlines()
-    count = 0
+    # inputs of the same id (e.g. a.pdb & a.cif.gz) would be written to the same output
+    ids = {}
+    for pdb in pdbs:
+        ids.setdefault(entry_id(pdb), []).append(pdb)
+    duplicates = [' '.join(files) for files in ids.values() if len(files) > 1]
+    assert not duplicates, "Input structures of the same name (output file): {:s}".format(', '.join(duplicates))
+    # manifest of completed, failed & skipped entries (status, input, output or error message[, length])
+    file_manifest = dir_out + '/manifest.tsv'
+    finished = set()
+    if resume and path.isfile(file_manifest):
+        # the last record of each entry; failed entries are processed again with retry_failed
+        with open(file_manifest, 'r') as f:
+            status = dict(l.split('\t')[1::-1] for l in f.read().splitlines() if l.count('\t') >= 2)
+        finished = set(pdb for pdb, st in status.items() if not (retry_failed and st == 'failed'))
+    manifest = open(file_manifest, 'a' if resume else 'w')
+    # tasks
+    tasks, stats = [], {'done':0, 'failed':0, 'skipped':0}
     for pdb in pdbs:
-        id = path.splitext(path.basename(pdb))[0]
-        infile = pdb
-        outfile = dir_out + '/' + id + '.csv'
-        count = count + 1
-        sys.stderr.write('\r\033[K' + '[{}/{}] processing... ({})'.format(count, len(pdbs), infile))
+        if pdb in finished:
+            stats['skipped'] += 1
+            continue
+        outfile = dir_out + '/' + entry_id(pdb) + '.csv'
+        if resume and format == 'csv' and path.isfile(outfile):
+            manifest.write('skipped\t{:s}\t{:s}\n'.format(pdb, outfile))
+            stats['skipped'] += 1
+            continue
+        tasks.append((pdb, dir_out, format, hypara))
+    # shards
+    shards = sorted(path.splitext(f)[0] for f in glob(dir_out + '/shard-*.idx')) if resume else []
+    writer, pending = None, []
+    # processing
+    pool = Pool(nworkers) if nworkers > 1 else None
+    results = pool.imap_unordered(preprocess_one, tasks, chunksize) if pool else map(preprocess_one, tasks)
+    time_ini = time.time()
+    for count, (pdb, status, output, data) in enumerate(results, 1):
+        stats[status] += 1
+        if format == 'shard' and status == 'done':
+            if writer is None:
+                shards.append(dir_out + '/shard-{:05d}'.format(len(shards)))
+                writer = ShardWriter(shards[-1], hypara)
+            writer.write(output, *data)
+            # entries are recorded when the shard is completed
+            pending.append('done\t{:s}\t{:s}:{:s}\t{:d}\n'.format(pdb, shards[-1], output, len(data[0])))
+            if len(writer) >= shard_size:
+                writer.close()
+                writer = None
+                manifest.write(''.join(pending))
+                pending = []
+        else:
+            manifest.write('{:s}\t{:s}\t{:s}\n'.format(status, pdb, output))
+        manifest.flush()
+        rate = count / (time.time() - time_ini)
+        sys.stderr.write('\r\033[K' + '[{}/{}] {:.2f} structures/s ({})'.format(count, len(tasks), rate, pdb))
         sys.stderr.flush()
-        node, edgemat, adjmat, label, mask, aa1 = pdb2input(infile, hypara)
-        with open(outfile, 'w') as f:
-            for iaa in range(len(node)):
-                feature = ','.join(map(str, np.round(node[iaa], decimals=5)))
-                f.write("NODE,%d,%s,%s,%d,%d\n" % (iaa, feature, aa1[iaa], label[iaa], mask[iaa]))
-            id1, id2 = np.where(adjmat[:,:,0]==True)
-            for i in range(len(id1)):
-                feature = ','.join(map(str, np.round(edgemat[id1[i],id2[i]], decimals=5)))
-                f.write("EDGE,%d,%d,%s\n" % (id1[i], id2[i], feature))
-    print("\nPre-processing was completed.")
+    if pool:
+        pool.close()
+        pool.join()
+    if writer is not None:
+        writer.close()
+        manifest.write(''.join(pending))
+    manifest.close()
+    if format == 'shard':
+        with open(dir_out + '/shard_list.txt', 'w') as f:
+            f.write(''.join(path.abspath(s) + '.idx\n' for s in shards))
+    elapsed = time.time() - time_ini
+    print("\nPre-processing was completed. (done: {:d}, failed: {:d}, skipped: {:d}, {:.2f} structures/s)".format(
+          stats['done'], stats['failed'], stats['skipped'], len(tasks) / elapsed if elapsed > 0 else 0.0))
     # return
-    return
+    return stats
+
+
+##  Add head, tail margins for sparse data (neighbor list)
+def add_margin_sparse(node, edge, nnidx, label, mask, nneighbor):
+    # for node, label, mask
+    node = np.concatenate((np.zeros((1, node.shape[1]), dtype=node.dtype), node,
+                           np.zeros((1, node.shape[1]), dtype=node.dtype)), axis=0)
+    label = np.concatenate((np.zeros((1, label.shape[1]), dtype=label.dtype), label,
+                            np.zeros((1, label.shape[1]), dtype=label.dtype)), axis=0)
+    mask = np.concatenate((np.zeros((1, mask.shape[1]), dtype=mask.dtype), mask,
+                           np.zeros((1, mask.shape[1]), dtype=mask.dtype)), axis=0)
+    # for edge
+    margin = np.zeros((1, edge.shape[1], edge.shape[2]), dtype=edge.dtype)
+    edge = np.concatenate((margin, edge, margin), axis=0)
+    # for neighbor list (margins point to the first nneighbor residues as in dense adjmat)
+    margin = np.arange(1, nneighbor+1, dtype=nnidx.dtype)[np.newaxis,:]
+    nnidx = np.concatenate((margin, nnidx+1, margin), axis=0)
+    # return
+    return node, edge, nnidx, label, mask
 
 
 ##  Add head, tail (left, right) margins for data 
 def add_margin(node, edgemat, adjmat, label, mask, nneighbor):
+    if np.issubdtype(adjmat.dtype, np.integer):
+        return add_margin_sparse(node, edgemat, adjmat, label, mask, nneighbor)
     # for node
     head_margin = np.zeros((1, node.shape[1]), dtype=np.float)
     tail_margin = np.zeros((1, node.shape[1]), dtype=np.float)
@@ -129,81 +340,198 @@ def add_margin(node, edgemat, adjmat, label, mask, nneighbor):
     return node, edgemat, adjmat, label, mask
 
 
+##  Parse preprocessed CSV data (without margins)
+def parse_csv(infile, sparse=False):
+    with open(infile, 'r') as f:
+        lines = f.read().splitlines()
+    nodelines = np.array([l.split(',') for l in lines if 'NODE' in l])
+    edgelines = np.array([l.split(',') for l in lines if 'EDGE' in l])
+    # node info
+    _, node, aa1, label, mask = np.hsplit(nodelines, [2, 8, 9, 10])
+    node = np.array(node, dtype='float')
+    size = len(node)
+    label = np.array(label, dtype='int')
+    mask = np.array(mask, dtype='int')
+    # edge info
+    _, row, col, val = np.hsplit(edgelines, [1, 2, 3])
+    if sparse:
+        row, col = np.array(row[:,0], dtype='int'), np.array(col[:,0], dtype='int')
+        order = np.lexsort((col, row))
+        adjmat = col[order].reshape(size, -1)
+        edgemat = np.array(val[order], dtype='float').reshape(size, adjmat.shape[1], -1)
+    else:
+        edgemat = np.zeros((size, size, 36), dtype=np.float)
+        adjmat = np.zeros((size, size, 1), dtype=np.bool)
+        for i in range(len(row)):
+            edgemat[int(row[i])][int(col[i])] = val[i]
+            adjmat[int(row[i])][int(col[i])] = 1
+    # return
+    return node, edgemat, adjmat, label, mask, list(aa1[:,0])
+
+
+##  Read preprocessed CSV data
+def read_csv(infile, nneighbor, sparse=False):
+    node, edgemat, adjmat, label, mask, _ = parse_csv(infile, sparse)
+    # add margin
+    node, edgemat, adjmat, label, mask = add_margin(node, edgemat, adjmat, label, mask, nneighbor)
+    # to Torch Tensor
+    node = torch.FloatTensor(node).squeeze()
+    label = torch.LongTensor(label).squeeze()
+    mask = torch.BoolTensor(mask).squeeze()
+    if sparse:
+        edgemat = torch.FloatTensor(edgemat)
+        adjmat = torch.LongTensor(adjmat)
+    else:
+        edgemat = torch.FloatTensor(edgemat).squeeze()
+        adjmat = torch.BoolTensor(adjmat).squeeze()
+    # return
+    return node, edgemat, adjmat, label, mask
+
+
+##  Number of residues in preprocessed CSV data
+def csv_length(infile):
+    with open(infile, 'rb') as f:
+        return f.read().count(b'NODE')
+
+
+##  Numbers of residues of CSV files without reading them: recorded in
+##  manifest.tsv of the preprocessing (in the directory of the files), or
+##  estimated from the file size (bytes per residue of one file read)
+def csv_lengths(files):
+    recorded = {}
+    for dir_csv in set(path.dirname(path.abspath(f)) for f in files):
+        file_manifest = dir_csv + '/manifest.tsv'
+        if not path.isfile(file_manifest):
+            continue
+        with open(file_manifest, 'r') as f:
+            for l in f.read().splitlines():
+                cols = l.split('\t')
+                if len(cols) == 4 and cols[0] == 'done':
+                    recorded[(dir_csv, path.basename(cols[2]))] = int(cols[3])
+    lengths, bytes_per_residue = [], None
+    for f in files:
+        length = recorded.get((path.dirname(path.abspath(f)), path.basename(f)))
+        if length is None:
+            if bytes_per_residue is None:
+                bytes_per_residue = path.getsize(f) / max(csv_length(f), 1)
+            length = max(int(round(path.getsize(f) / bytes_per_residue)), 1)
+        lengths.append(length)
+    return lengths
+
+
 ##  Dataset
 class BBGDataset(Dataset):
-    def __init__(self, listfile, hypara):
+    def __init__(self, listfile, hypara, sparse=False):
         with open(listfile, 'r') as f:
             self.list_samples = f.read().splitlines()
         self.nneighbor = hypara.nneighbor
+        self.sparse = sparse
+        # for length bucketing (the files are not read here)
+        self.lengths = csv_lengths(self.list_samples)
     def __len__(self):
         return len(self.list_samples)
     def __getitem__(self, idx):
         infile = self.list_samples[idx]
-        with open(infile, 'r') as f:
-            lines = f.read().splitlines()
-        nodelines = np.array([l.split(',') for l in lines if 'NODE' in l])
-        edgelines = np.array([l.split(',') for l in lines if 'EDGE' in l])
-        # node info
-        _, node, aa1, label, mask = np.hsplit(nodelines, [2, 8, 9, 10])
-        node = np.array(node, dtype='float')
-        size = len(node)
-        label = np.array(label, dtype='int')
-        mask = np.array(mask, dtype='int')
-        # edge info
-        _, row, col, val = np.hsplit(edgelines, [1, 2, 3])
-        edgemat = np.zeros((size, size, 36), dtype=np.float)
-        adjmat = np.zeros((size, size, 1), dtype=np.bool)
-        for i in range(len(row)):
-            edgemat[int(row[i])][int(col[i])] = val[i]
-            adjmat[int(row[i])][int(col[i])] = 1
-        # add margin
-        node, edgemat, adjmat, label, mask = add_margin(node, edgemat, adjmat, label, mask, self.nneighbor)
-        # to Torch Tensor
-        node = torch.FloatTensor(node).squeeze()
-        edgemat = torch.FloatTensor(edgemat).squeeze()
-        adjmat = torch.BoolTensor(adjmat).squeeze()
-        label = torch.LongTensor(label).squeeze()
-        mask = torch.BoolTensor(mask).squeeze()
+        node, edgemat, adjmat, label, mask = read_csv(infile, self.nneighbor, self.sparse)
         # return
         return node, edgemat, adjmat, label, mask, self.list_samples[idx]
 
 
 ##  Dataset
 class BBGDataset_fast(Dataset):
-    def __init__(self, listfile, hypara):
+    def __init__(self, listfile, hypara, sparse=False):
         with open(listfile, 'r') as f:
             self.list_samples = f.read().splitlines()
         self.nneighbor = hypara.nneighbor
+        self.sparse = sparse
         self.data = []
+        from tqdm import tqdm
         for sample in tqdm(self.list_samples):
-            with open(sample, 'r') as f:
-                lines = f.read().splitlines()
-            nodelines = np.array([l.split(',') for l in lines if 'NODE' in l])
-            edgelines = np.array([l.split(',') for l in lines if 'EDGE' in l])
-            # node info
-            _, node, aa1, label, mask = np.hsplit(nodelines, [2, 8, 9, 10])
-            node = np.array(node, dtype='float')
-            size = len(node)
-            label = np.array(label, dtype='int')
-            mask = np.array(mask, dtype='int')
-            # edge info
-            _, row, col, val = np.hsplit(edgelines, [1, 2, 3])
-            edgemat = np.zeros((size, size, 36), dtype=np.float)
-            adjmat = np.zeros((size, size, 1), dtype=np.bool)
-            for i in range(len(row)):
-                edgemat[int(row[i])][int(col[i])] = val[i]
-                adjmat[int(row[i])][int(col[i])] = 1
-            # add margin
-            node, edgemat, adjmat, label, mask = add_margin(node, edgemat, adjmat, label, mask, self.nneighbor)
-            # to Torch Tensor
-            node = torch.FloatTensor(node).squeeze()
-            edgemat = torch.FloatTensor(edgemat).squeeze()
-            adjmat = torch.BoolTensor(adjmat).squeeze()
-            label = torch.LongTensor(label).squeeze()
-            mask = torch.BoolTensor(mask).squeeze()
+            node, edgemat, adjmat, label, mask = read_csv(sample, self.nneighbor, self.sparse)
             self.data.append((node, edgemat, adjmat, label, mask, sample))
+        self.lengths = [len(d[0])-2 for d in self.data]
         return
     def __len__(self):
         return len(self.list_samples)
     def __getitem__(self, idx):
         return self.data[idx]
+
+
+##  Dataset (memory-mapped binary shards)
+class BBGDataset_shard(Dataset):
+    def __init__(self, listfile, hypara, sparse=True):
+        with open(listfile, 'r') as f:
+            self.list_shards = f.read().splitlines()
+        self.nneighbor = hypara.nneighbor
+        self.sparse = sparse
+        self.samples = []
+        for ishard, idxfile in enumerate(self.list_shards):
+            index = read_shard_index(idxfile)
+            assert index['nneighbor'] == self.nneighbor, "nneighbor of {:s} does not match.".format(idxfile)
+            self.samples += [(ishard, e['name'], e['offset'], e['length']) for e in index['entries']]
+        self.lengths = [length-2 for _, _, _, length in self.samples]
+        self.maps = {}
+    def __len__(self):
+        return len(self.samples)
+    def __getitem__(self, idx):
+        ishard, name, offset, length = self.samples[idx]
+        if ishard not in self.maps:
+            binfile = path.splitext(self.list_shards[ishard])[0] + '.bin'
+            self.maps[ishard] = np.memmap(binfile, dtype=np.uint8, mode='c')
+        layout, size = shard_layout(length, self.nneighbor)
+        record = self.maps[ishard][offset:offset+size]
+        data = {}
+        for field, dtype, shape, ini in layout:
+            nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            data[field] = record[ini:ini+nbytes].view(dtype).reshape(shape)
+        # to Torch Tensor (node & edge are not copied)
+        node = torch.from_numpy(data['node'])
+        edgemat = torch.from_numpy(data['edge'])
+        adjmat = torch.from_numpy(data['nnidx']).long()
+        label = torch.from_numpy(data['label']).long()
+        mask = torch.from_numpy(data['mask'])
+        if not self.sparse:
+            nnidx = adjmat
+            adjmat = torch.zeros((length, length), dtype=torch.bool).scatter_(1, nnidx, True)
+            edgemat = torch.zeros((length, length, edgemat.shape[2]), dtype=torch.float).scatter_(
+                1, nnidx.unsqueeze(2).expand(-1, -1, edgemat.shape[2]), edgemat)
+        # return
+        return node, edgemat, adjmat, label, mask, name
+
+
+##  Dataset (decoded once into a shard in shared memory)
+def _parse_csv_sparse(infile):
+    return parse_csv(infile, sparse=True)
+
+def _remove_cache(dir_cache, pid):
+    # only by the process which created the cache (not by forked workers)
+    if os.getpid() == pid:
+        shutil.rmtree(dir_cache, ignore_errors=True)
+
+class BBGDataset_shared(BBGDataset_shard):
+    """
+    Samples of a CSV list decoded once (in 'nworkers' processes) into a
+    binary shard in shared memory (/dev/shm by default, or 'dir_cache'),
+    which the trainer & DataLoader workers map without copying. The shard
+    is removed with the dataset.
+    """
+    def __init__(self, listfile, hypara, sparse=True, nworkers: int=1, dir_cache: str=None):
+        with open(listfile, 'r') as f:
+            list_samples = f.read().splitlines()
+        if dir_cache is None and path.isdir('/dev/shm'):
+            dir_cache = '/dev/shm'
+        self.dir_cache = tempfile.mkdtemp(prefix='gcndesign-', dir=dir_cache)
+        self._finalizer = weakref.finalize(self, _remove_cache, self.dir_cache, os.getpid())
+        # decode
+        writer = ShardWriter(self.dir_cache + '/shard', hypara)
+        pool = Pool(nworkers) if nworkers > 1 else None
+        results = pool.imap(_parse_csv_sparse, list_samples, 8) if pool else map(_parse_csv_sparse, list_samples)
+        for sample, data in zip(list_samples, results):
+            writer.write(sample, *data)
+        if pool:
+            pool.close()
+            pool.join()
+        writer.close()
+        with open(self.dir_cache + '/shard_list.txt', 'w') as f:
+            f.write(self.dir_cache + '/shard.idx\n')
+        super(BBGDataset_shared, self).__init__(self.dir_cache + '/shard_list.txt', hypara, sparse)
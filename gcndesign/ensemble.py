@@ -0,0 +1,62 @@
+import copy
+import torch
+import torch.nn as nn
+from torch.func import stack_module_state, functional_call, vmap
+
+
+##  Ensemble of models (same architecture) with MC-dropout sampling
+class ModelEnsemble:
+    """
+    Evaluates the members (e.g. checkpoints of different epochs) and,
+    if mc_samples > 1, dropout samples of each member on one featurized
+    input. BatchNorm layers use their running statistics in any case.
+
+    With batched=True the members are evaluated in one vectorized pass
+    (torch.func.vmap over the stacked parameters, dropout samples as
+    segments of one graph), which suits GPUs. Otherwise the members &
+    samples are evaluated one by one, which is faster on CPU.
+    """
+
+    def __init__(self, models):
+        self.models = [m.eval() for m in models]
+        self.stacked = None
+
+    def __len__(self):
+        return len(self.models)
+
+    @staticmethod
+    def _dropout(model, active):
+        for m in model.modules():
+            if isinstance(m, nn.Dropout):
+                m.train(active)
+
+    def _stack(self):
+        if self.stacked is None:
+            params, buffers = stack_module_state(self.models)
+            base = copy.deepcopy(self.models[0]).to('meta')
+            self.stacked = (base, params, buffers)
+        return self.stacked
+
+    def forward(self, node, edge, nnidx, mc_samples: int=1, batched: bool=False):
+        # returns logits (nmember x mc_samples, naa, d_out)
+        with torch.inference_mode():
+            if not batched:
+                outputs = []
+                for model in self.models:
+                    self._dropout(model, mc_samples > 1)
+                    outputs += [model(node, edge, nnidx) for _ in range(mc_samples)]
+                    self._dropout(model, False)
+                return torch.stack(outputs)
+            # dropout samples as segments of one graph
+            naa = node.size(0)
+            if mc_samples > 1:
+                node = node.repeat(mc_samples, 1)
+                edge = edge.repeat(mc_samples, 1, 1)
+                nnidx = torch.cat([nnidx + i*naa for i in range(mc_samples)])
+            segments = [naa] * mc_samples if mc_samples > 1 else None
+            base, params, buffers = self._stack()
+            self._dropout(base, mc_samples > 1)
+            func = lambda p, b: functional_call(base, (p, b), (node, edge, nnidx), {'segments': segments})
+            outputs = vmap(func, randomness='different')(params, buffers)
+            self._dropout(base, False)
+            return outputs.reshape(len(self.models) * mc_samples, naa, -1)
@@ -0,0 +1,133 @@
+import copy
+import zipfile
+import torch
+import torch.nn as nn
+from .models import ResBlock_BatchNorm
+
+
+##  Affine transformation (y = scale * x + shift) of eval-mode BatchNorm1d
+def bn_affine(bn):
+    scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+    shift = bn.bias - bn.running_mean * scale
+    return scale, shift
+
+
+##  Scale & shift the output channels of Conv1d
+def scale_conv(conv, scale, shift=None):
+    bias = conv.bias if conv.bias is not None else torch.zeros(conv.out_channels)
+    conv.weight = nn.Parameter(conv.weight * scale[:, None, None])
+    conv.bias = nn.Parameter(bias * scale + (0 if shift is None else shift))
+    return conv
+
+
+##  BatchNorm1d followed by Conv1d (kernel_size=1) -> Conv1d
+def fold_bn_conv(bn, conv):
+    assert conv.kernel_size == (1,) and conv.padding == (0,), "Only kernel_size=1 convolution can absorb preceding BatchNorm1d."
+    scale, shift = bn_affine(bn)
+    bias = conv.bias if conv.bias is not None else torch.zeros(conv.out_channels)
+    conv.bias = nn.Parameter(bias + conv.weight[:, :, 0] @ shift)
+    conv.weight = nn.Parameter(conv.weight * scale[None, :, None])
+    return conv
+
+
+##  Fold BatchNorm1d layers into adjacent Conv1d layers & strip Dropout
+def fold_batchnorm(model):
+    """
+    Returns a copy of the model in eval mode, in which the following
+    BatchNorm1d layers are folded into the adjacent Conv1d layers:
+      - conv1 -> bn2 in ResBlock_BatchNorm
+      - bn -> conv (kernel_size=1) in the shortcut of ResBlock_BatchNorm
+      - Conv1d -> BatchNorm1d in layer lists
+      - ResBlock_BatchNorm (with convolutional shortcut) -> BatchNorm1d in layer lists
+    Dropout layers are replaced by Identity. InstanceNorm1d layers use
+    per-input statistics and cannot be folded.
+    """
+    model = copy.deepcopy(model).cpu().eval()
+    with torch.no_grad():
+        for m in list(model.modules()):
+            if isinstance(m, ResBlock_BatchNorm):
+                m.conv1 = scale_conv(m.conv1, *bn_affine(m.bn2))
+                m.bn2 = nn.Identity()
+                if isinstance(m.shortcut._modules.get('bn'), nn.BatchNorm1d):
+                    m.shortcut.conv = fold_bn_conv(m.shortcut.bn, m.shortcut.conv)
+                    m.shortcut.bn = nn.Identity()
+            elif isinstance(m, nn.ModuleList):
+                for i in range(len(m)-1):
+                    if not isinstance(m[i+1], nn.BatchNorm1d): continue
+                    scale, shift = bn_affine(m[i+1])
+                    if isinstance(m[i], nn.Conv1d):
+                        m[i] = scale_conv(m[i], scale, shift)
+                    elif isinstance(m[i], ResBlock_BatchNorm) and 'conv' in m[i].shortcut._modules:
+                        m[i].conv2 = scale_conv(m[i].conv2, scale, shift)
+                        m[i].shortcut.conv = scale_conv(m[i].shortcut.conv, scale)
+                    else:
+                        continue
+                    m[i+1] = nn.Identity()
+        # strip dropout
+        for m in list(model.modules()):
+            for name, child in m.named_children():
+                if isinstance(child, nn.Dropout):
+                    m._modules[name] = nn.Identity()
+    return model
+
+
+##  Conv1d (kernel_size=1) as Linear over channels, for dynamic quantization
+class Conv1x1Linear(nn.Module):
+    def __init__(self, conv):
+        super(Conv1x1Linear, self).__init__()
+        self.linear = nn.Linear(conv.in_channels, conv.out_channels, bias=conv.bias is not None)
+        self.linear.weight = nn.Parameter(conv.weight.detach()[:, :, 0].clone())
+        if conv.bias is not None:
+            self.linear.bias = nn.Parameter(conv.bias.detach().clone())
+    def forward(self, x):
+        return self.linear(x.transpose(1, 2)).transpose(1, 2)
+
+
+##  Int8 dynamic quantization of the graph-convolution layers (CPU only)
+def quantize_model(model, dtype='int8'):
+    """
+    Returns a copy of the model with folded BatchNorm1d layers, in which the
+    kernel_size=1 Conv1d layers of the edge-update & encoding layers of the
+    RGC blocks (applied to naa x nneighbor edge rows) are replaced by Linear
+    layers with per-channel int8 weights & dynamically quantized activations.
+    The residual layers (naa rows) are kept in float.
+    """
+    assert dtype == 'int8', "Quantization type {:s} is not supported.".format(dtype)
+    model = fold_batchnorm(model)
+    for block in model.embedding.rgclayer:
+        for layer in [getattr(block, l) for l in ('edgeupdate', 'encoding') if hasattr(block, l)]:
+            for m in list(layer.modules()):
+                for name, child in m.named_children():
+                    if isinstance(child, nn.Conv1d) and child.kernel_size == (1,):
+                        m._modules[name] = Conv1x1Linear(child)
+    qconfig = {name: torch.ao.quantization.per_channel_dynamic_qconfig
+               for name, m in model.named_modules() if isinstance(m, nn.Linear)}
+    return torch.ao.quantization.quantize_dynamic(model, qconfig, dtype=torch.qint8)
+
+
+##  Random sparse-graph input for tracing
+def example_input(naa=64, nneighbor=20):
+    node = torch.randn(naa, 6)
+    edge = torch.randn(naa, nneighbor, 36)
+    nnidx = torch.stack([torch.randperm(naa)[:nneighbor] for _ in range(naa)])
+    return node, edge, nnidx
+
+
+##  Export folded model as a TorchScript (traced) artifact
+def export_model(model, outfile, nneighbor=20, example=None, fold=True):
+    model = fold_batchnorm(model) if fold else copy.deepcopy(model).cpu().eval()
+    example = example if example else example_input(64, nneighbor)
+    # traced with sparse input (neighbor list) & no segments
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example, check_inputs=[example_input(97, nneighbor)])
+    traced = torch.jit.freeze(traced)
+    traced.save(outfile)
+    return traced
+
+
+##  TorchScript archive or not
+def is_torchscript(file):
+    if not zipfile.is_zipfile(file):
+        return False
+    with zipfile.ZipFile(file) as zf:
+        return any(n.split('/')[1:2] == ['code'] for n in zf.namelist())
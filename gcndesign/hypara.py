@@ -53,3 +53,4 @@ class InputSource:
     resfile_out: str = None
     prob_cut:  float = 0.80
     device:      str = 'cpu'
+    precision:   str = 'fp32'
@@ -0,0 +1,114 @@
+import numpy as np
+import torch
+import torch.nn as nn
+from .models import conv1d_segments
+from .partition import subgraph, rgc_partition
+
+
+##  Residue correspondence to a reference structure (by CA coordinates)
+def match_residues(coord, coord_ref):
+    # index in the reference for each residue (-1 for new residues), margins to margins
+    table = {c.tobytes(): i for i, c in enumerate(coord_ref[1:-1], 1)}
+    index = np.array([0] + [table.get(c.tobytes(), -1) for c in coord[1:-1]] + [len(coord_ref)-1], dtype=np.int64)
+    return index
+
+
+##  Rows whose RGC inputs differ from the reference
+def changed_rows(entry, ref, index, tol=0.0):
+    j = np.maximum(index, 0)
+    changed = index < 0
+    changed |= np.abs(entry['node0'] - ref['node0'][j]).max(axis=1) > tol
+    changed |= np.abs(entry['edge'] - ref['edge'][j]).max(axis=(1, 2)) > 0
+    changed |= np.any(index[entry['nnidx']] != ref['nnidx'][j], axis=1)
+    return changed
+
+
+##  Rows reached from the changed rows within 'nhop' RGC blocks
+def affected_rows(nnidx, changed, nhop):
+    # output of a block depends on the row itself & its neighbors in the previous block
+    for _ in range(nhop):
+        changed = changed | changed[nnidx].any(axis=1)
+    return changed
+
+
+##  Rows within the sequence window of the prediction module (convolutions)
+def window_rows(prediction, rows, n):
+    width = sum((m.kernel_size[0]-1)//2 for m in prediction.modules() if isinstance(m, nn.Conv1d))
+    window = np.zeros(n, dtype=bool)
+    window[np.clip(np.add.outer(np.asarray(rows), np.arange(-width, width+1)), 0, n-1)] = True
+    return window
+
+
+##  Inference restricted to the receptive field of the changes from a reference
+def local_forward(model, entry, ref=None, tol=0.0, targets=None):
+    """
+    Computes 'node0' (1st embedding), 'latent' (output of the RGC blocks) &
+    'logit' of a featurized entry (sparse input with margins), reusing the
+    latent of the reference entry (same keys) for the residues outside the
+    receptive field of the changes. Residues are matched to the reference
+    by their CA coordinates, so that edits by insertion or deletion are
+    also handled.
+
+    The 1D modules (instance normalization over the whole chain) are
+    applied to the whole chain, so any structural change shifts node0 of
+    all residues slightly. The rows whose node0 differs by at most 'tol'
+    are regarded as unchanged: tol=0 gives the same output as the forward
+    of the whole graph (typically all rows are recomputed after an edit);
+    tol > 0 restricts the computation to the neighborhood of the edit, and
+    'deviation' (the largest node0 difference of the reused rows) tells
+    how far the result may be from the exact one.
+
+    'targets' (row indices of the entry, i.e. residue index + 1) restricts
+    the recomputation further to the rows the logits of the targets depend
+    on (the sequence window of the prediction module). The other affected
+    rows keep the latent of the reference (marked in 'stale'; their logits
+    are not exact, & as the prediction module normalizes over the whole
+    chain, neither are the logits of the targets, even with tol=0). Stale
+    rows of the reference are recomputed when they fall in the window.
+    Without a reference, all rows are computed.
+
+    Returns the entry with the keys above & 'nrecomputed', 'deviation',
+    'stale'.
+    """
+    model.eval()
+    rgclayer = model.embedding.rgclayer
+    device = next(model.parameters()).device
+    with torch.inference_mode():
+        node0 = conv1d_segments(model.embedding.nodefeature0, torch.from_numpy(entry['node']).to(device))
+    entry['node0'] = node0.cpu().numpy()
+    if ref is None:
+        index = np.full(len(entry['node']), -1, dtype=np.int64)
+        changed = np.ones(len(entry['node']), dtype=bool)
+    else:
+        index = match_residues(entry['coord'], ref['coord'])
+        changed = changed_rows(entry, ref, index, tol)
+    affected = affected_rows(entry['nnidx'], changed, len(rgclayer))
+    if ref is not None and 'stale' in ref:
+        affected |= (index >= 0) & ref['stale'][np.maximum(index, 0)]
+    stale = np.zeros(len(entry['node']), dtype=bool)
+    if targets is not None and ref is not None:
+        # rows without a reference latent are always computed
+        needed = window_rows(model.prediction, targets, len(entry['node'])) | (index < 0)
+        stale = affected & ~needed
+        affected &= needed
+    core = np.flatnonzero(affected)
+    reused = np.flatnonzero(index >= 0)
+    reused = np.setdiff1d(reused, core, assume_unique=True)
+    # RGC blocks applied to the affected rows (with halo)
+    latent = None
+    if len(core) > 0:
+        out = rgc_partition(rgclayer, *subgraph(entry['node0'], entry['edge'], entry['nnidx'], core, len(rgclayer)))
+        latent = np.zeros((len(entry['node']), out.shape[1]), dtype=out.dtype)
+        latent[core] = out
+    if len(reused) > 0:
+        if latent is None:
+            latent = np.zeros((len(entry['node']), ref['latent'].shape[1]), dtype=ref['latent'].dtype)
+        latent[reused] = ref['latent'][index[reused]]
+    entry['latent'] = latent
+    with torch.inference_mode():
+        entry['logit'] = model.prediction(torch.from_numpy(latent).to(device))[1:-1].cpu().numpy()
+    entry['nrecomputed'] = np.array(len(core))
+    deviation = np.abs(entry['node0'][reused] - ref['node0'][index[reused]]).max() if len(reused) > 0 else 0.0
+    entry['deviation'] = np.array(deviation, dtype=np.float32)
+    entry['stale'] = stale
+    return entry
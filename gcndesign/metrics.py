@@ -0,0 +1,108 @@
+import torch
+import torch.distributed as dist
+import torch.nn.functional as F
+
+
+##  Accumulated metrics of amino-acid prediction (kept on the device)
+class Metrics:
+    """
+    Accumulates cross-entropy loss, recovery, top-k recovery, the confusion
+    matrix (native x predicted) and statistics per protein-length bin with
+    batched tensor operations on the device of the outputs. The values are
+    transferred to the host only by compute().
+
+    Parameters
+    ----------
+    nclass : int
+        Number of amino-acid types.
+    topk : tuple
+        k of the top-k recoveries.
+    length_bins : tuple
+        Boundaries of the protein-length bins (number of residues).
+    """
+
+    def __init__(self, nclass: int=20, topk=(3, 5), length_bins=(100, 200, 300, 500)):
+        self.nclass = nclass
+        self.topk = tuple(topk)
+        self.length_bins = tuple(length_bins)
+        self.data = None
+
+    def _init(self, device):
+        nbin = len(self.length_bins) + 1
+        self.data = {'loss': torch.zeros((), dtype=torch.float64, device=device),
+                     'count': torch.zeros((), dtype=torch.float64, device=device),
+                     'correct': torch.zeros((), dtype=torch.float64, device=device),
+                     'topk': torch.zeros(len(self.topk), dtype=torch.float64, device=device),
+                     'confusion': torch.zeros(self.nclass*self.nclass, dtype=torch.float64, device=device),
+                     'bin_loss': torch.zeros(nbin, dtype=torch.float64, device=device),
+                     'bin_count': torch.zeros(nbin, dtype=torch.float64, device=device),
+                     'bin_correct': torch.zeros(nbin, dtype=torch.float64, device=device),
+                     'bin_proteins': torch.zeros(nbin, dtype=torch.float64, device=device)}
+
+    @torch.no_grad()
+    def update(self, outputs, target, mask, segments=None):
+        """
+        Adds a batch: logits (naa, nclass), target (naa), mask (naa) and the
+        segment lengths (with margins) of the proteins. Returns the loss sum,
+        residue count & correct count of each protein (on the device).
+        """
+        device = outputs.device
+        if self.data is None:
+            self._init(device)
+        segments = [len(outputs)] if segments is None else list(segments)
+        weight = mask.to(torch.float64)
+        trg = target.clamp(min=0)
+        loss = F.cross_entropy(outputs.float(), trg, reduction='none').to(torch.float64) * weight
+        ranked = outputs.topk(max((1,) + self.topk), dim=1).indices
+        hit = (ranked == trg.unsqueeze(1)).to(torch.float64) * weight.unsqueeze(1)
+        correct = hit[:, 0]
+        # per protein
+        segid = torch.repeat_interleave(torch.arange(len(segments), device=device),
+                                        torch.tensor(segments, device=device))
+        seg_loss = torch.zeros(len(segments), dtype=torch.float64, device=device).index_add_(0, segid, loss)
+        seg_count = torch.zeros(len(segments), dtype=torch.float64, device=device).index_add_(0, segid, weight)
+        seg_correct = torch.zeros(len(segments), dtype=torch.float64, device=device).index_add_(0, segid, correct)
+        # length bins (without margins)
+        lengths = torch.tensor(segments, device=device) - 2
+        ibin = torch.bucketize(lengths, torch.tensor(self.length_bins, device=device), right=True)
+        # accumulate
+        d = self.data
+        d['loss'] += loss.sum()
+        d['count'] += weight.sum()
+        d['correct'] += correct.sum()
+        d['topk'] += torch.stack([hit[:, :k].sum() for k in self.topk]) if self.topk else 0
+        d['confusion'].index_add_(0, trg*self.nclass + ranked[:, 0], weight)
+        d['bin_loss'].index_add_(0, ibin, seg_loss)
+        d['bin_count'].index_add_(0, ibin, seg_count)
+        d['bin_correct'].index_add_(0, ibin, seg_correct)
+        d['bin_proteins'].index_add_(0, ibin, torch.ones_like(seg_loss))
+        return seg_loss, seg_count, seg_correct
+
+    def compute(self):
+        """
+        Returns a dict of 'loss' (mean), 'recovery' (%), 'topk' {k: %},
+        'confusion' (nclass x nclass counts) & 'bins' [(lower, upper,
+        proteins, residues, loss, recovery), ...], with one transfer.
+        In distributed training, the sums of all processes are used (all
+        processes must call this).
+        """
+        if self.data is None:
+            self._init('cpu')
+        keys = list(self.data.keys())
+        sizes = [self.data[k].numel() for k in keys]
+        flat = torch.cat([self.data[k].reshape(-1) for k in keys])
+        if dist.is_available() and dist.is_initialized():
+            dist.all_reduce(flat)
+        flat = flat.cpu()
+        d = dict(zip(keys, torch.split(flat, sizes)))
+        count = d['count'].item()
+        lowers = (0,) + self.length_bins
+        uppers = self.length_bins + (None,)
+        bins = [(lo, up, int(p), int(c), l/c if c > 0 else float('nan'), 100*r/c if c > 0 else float('nan'))
+                for lo, up, p, c, l, r in zip(lowers, uppers, d['bin_proteins'].tolist(), d['bin_count'].tolist(),
+                                              d['bin_loss'].tolist(), d['bin_correct'].tolist())]
+        return {'loss': d['loss'].item() / count if count > 0 else float('nan'),
+                'recovery': 100 * d['correct'].item() / count if count > 0 else float('nan'),
+                'topk': {k: 100 * v / count if count > 0 else float('nan') for k, v in zip(self.topk, d['topk'].tolist())},
+                'confusion': d['confusion'].reshape(self.nclass, self.nclass).long().numpy(),
+                'bins': bins}
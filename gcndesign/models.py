@@ -1,6 +1,8 @@
+import contextlib
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
 
 ##  Weight initialization
 def weights_init(m):
@@ -16,6 +18,44 @@ def weights_init(m):
         m.bias.data.fill_(0)
 
 
+##  Apply 1D convolution layers to (naa, d) features; separately for each
+##  segment (protein) of a batch so that convolution windows & instance
+##  normalization do not mix proteins. The layers run in float32 also under
+##  autocast (instance normalization over the whole chain)
+def conv1d_segments(layers, x, segments=None):
+    out = []
+    with torch.autocast(device_type=x.device.type, enabled=False):
+        for xseg in ([x.float()] if segments is None else torch.split(x.float(), segments, dim=0)):
+            xseg = xseg.transpose(0, 1).unsqueeze(0)
+            for f in layers:
+                xseg = f(xseg)
+            out.append(xseg.squeeze(0).transpose(0, 1))
+    return out[0] if len(out) == 1 else torch.cat(out, 0)
+
+
+##  Autocast for the precision of computation ('fp32' or 'bf16'; the RGC
+##  blocks run in bfloat16, the 1D modules & the outputs stay float32)
+def precision_autocast(device, precision=None):
+    assert precision in (None, 'fp32', 'bf16'), "Unknown precision {:s}.".format(str(precision))
+    return torch.autocast(device_type=torch.device(device).type, dtype=torch.bfloat16, enabled=precision == 'bf16')
+
+
+##  BatchNorm running statistics kept unchanged (for recomputation in backward)
+@contextlib.contextmanager
+def frozen_bn_stats(module):
+    bns = [m for m in module.modules() if isinstance(m, nn.modules.batchnorm._BatchNorm)]
+    saved = [(m.momentum, m.num_batches_tracked.clone() if m.num_batches_tracked is not None else None) for m in bns]
+    for m in bns:
+        m.momentum = 0.0
+    try:
+        yield
+    finally:
+        for m, (momentum, nbt) in zip(bns, saved):
+            m.momentum = momentum
+            if nbt is not None:
+                m.num_batches_tracked.copy_(nbt)
+
+
 ##  ResBlock with InstanceNormalization
 class ResBlock_InstanceNorm(nn.Module):
     def __init__(self, d_in, d_out, dropout=0.2):
@@ -102,16 +142,17 @@ class RGCBlock(nn.Module):
             [nn.ReLU()]
         )
             
-    def forward(self, x, edgevec, adjmat):
-        naa = adjmat.size()[0]
-        # node-vec
-        node_expand = x.unsqueeze(0).expand(naa, naa, self.d_in)
-        nodetrg = node_expand[adjmat, :].reshape(naa, -1, self.d_in)
-        nodesrc = x.unsqueeze(1).expand(naa, self.nneighbor, self.d_in)
+    def forward(self, x, edgevec, nnidx):
+        # rows of nnidx (& edgevec) are the first naa nodes of x
+        naa, nneighbor = nnidx.size()
+        # node-vec (gather neighbors by index)
+        nodetrg = x[nnidx]
+        x = x[:naa]
+        nodesrc = x.unsqueeze(1).expand(naa, nneighbor, self.d_in)
         ## edge update ##
         # concat node-vec & edge-vec
         if(self.nlayer_edge > 0):
-            selfnode = x.unsqueeze(1).expand(naa, self.nneighbor, self.d_in)
+            selfnode = x.unsqueeze(1).expand(naa, nneighbor, self.d_in)
             nen = torch.cat((selfnode, edgevec, nodetrg), 2).transpose(1, 2)
             for f in self.edgeupdate:
                 nen = f(nen)
@@ -160,19 +201,29 @@ class Embedding_module(nn.Module):
             [RGCBlock(d_node0+k_node_rgc*i, d_node0+k_node_rgc*(i+1), self.d_edge_in+k_edge_rgc*i, self.d_edge_in+k_edge_rgc*(i+1),
                       nneighbor, d_hidden_node, d_hidden_edge, nlayer_node, nlayer_edge, r_drop) for i in range(niter_rgc)]
         )
+        # activation checkpointing of RGC blocks (recomputed in backward)
+        self.checkpoint = False
 
-    def forward(self, node_in, edgemat_in, adjmat_in):
+    def forward(self, node_in, edgemat_in, adjmat_in, segments=None):
         naa = node_in.size()[0]
         # edge
-        edge = edgemat_in[adjmat_in, :].reshape(naa, -1, self.d_edge_in)
+        if adjmat_in.dtype == torch.bool:
+            # dense input: converted to neighbor list
+            edge = edgemat_in[adjmat_in, :].reshape(naa, -1, self.d_edge_in)
+            nnidx = adjmat_in.nonzero()[:, 1].reshape(naa, -1)
+        else:
+            # sparse input: neighbor list (naa, nneighbor) & edge features (naa, nneighbor, 36)
+            edge, nnidx = edgemat_in, adjmat_in
         # node embedding
-        node = node_in.transpose(0, 1).unsqueeze(0)
-        for f in self.nodefeature0:
-            node = f(node)
-        node = node.squeeze(0).transpose(0, 1)
+        node = conv1d_segments(self.nodefeature0, node_in, segments)
         # Graph Convolution
+        use_checkpoint = getattr(self, 'checkpoint', False) and self.training and torch.is_grad_enabled()
         for f in self.rgclayer:
-            node, edge = f(node, edge, adjmat_in)
+            if use_checkpoint:
+                node, edge = checkpoint(f, node, edge, nnidx, use_reentrant=False,
+                                        context_fn=lambda f=f: (contextlib.nullcontext(), frozen_bn_stats(f)))
+            else:
+                node, edge = f(node, edge, nnidx)
         # output
         return node, edge
 
@@ -196,13 +247,10 @@ class Prediction_module(nn.Module):
             [nn.ReLU()] +
             [nn.Conv1d(d_hidden2, d_out, kernel_size=1, stride=1, padding=0)]
         )
-    def forward(self, node_in):
-        node_out = node_in.transpose(0, 1).unsqueeze(0)
+    def forward(self, node_in, segments=None):
         # prediction layer
-        for f in self.pred1Dconv:
-            node_out = f(node_out)
+        node_out = conv1d_segments(self.pred1Dconv, node_in, segments)
         # output
-        node_out = node_out.squeeze(0).transpose(0, 1)
         return(node_out)
 
 
@@ -240,13 +288,13 @@ class GCNdesign(nn.Module):
                 params += p.numel()
         return params
         
-    def forward(self, node_in, edgemat_in, adjmat_in):
+    def forward(self, node_in, edgemat_in, adjmat_in, segments=None):
         # embedding
-        latent, _ = self.embedding(node_in, edgemat_in, adjmat_in)
+        latent, _ = self.embedding(node_in, edgemat_in, adjmat_in, segments)
         # prediction
-        out = self.prediction(latent)
+        out = self.prediction(latent, segments)
         # output
         return out
 
-    def get_embedding(self, node_in, edgemat_in, adjmat_in):
-        return self.embedding(node_in, edgemat_in, adjmat_in)
+    def get_embedding(self, node_in, edgemat_in, adjmat_in, segments=None):
+        return self.embedding(node_in, edgemat_in, adjmat_in, segments)
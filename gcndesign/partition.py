@@ -0,0 +1,130 @@
+from multiprocessing import Pool
+import numpy as np
+import torch
+from .models import conv1d_segments
+
+
+##  Recursive coordinate bisection: spatial partitions of at most 'size' residues
+def spatial_partition(coord, size):
+    parts, stack = [], [np.arange(len(coord))]
+    while stack:
+        idx = stack.pop()
+        if len(idx) <= size:
+            parts.append(np.sort(idx))
+            continue
+        # bisection along the longest extent
+        axis = np.argmax(np.ptp(coord[idx], axis=0))
+        idx = idx[np.argsort(coord[idx, axis], kind='stable')]
+        stack.extend([idx[len(idx)//2:], idx[:len(idx)//2]])
+    return parts
+
+
+##  Halo of a partition: nodes within 'nhop' hops along the neighbor list
+def halo_closure(nnidx, core, nhop):
+    """
+    Returns the nodes within nhop hops from the core nodes, ordered by the
+    number of hops, and the number of nodes within 0, 1, ..., nhop hops.
+    The output of the RGC block t (1, ..., nhop) depends only on the nodes
+    within one hop after the block t-1, so it is exact for the first
+    nsize[nhop-t] nodes.
+    """
+    hop = np.full(len(nnidx), nhop+1, dtype=np.int64)
+    hop[core] = 0
+    frontier = core
+    for ihop in range(1, nhop+1):
+        frontier = np.unique(nnidx[frontier])
+        frontier = frontier[hop[frontier] > nhop]
+        hop[frontier] = ihop
+    order = np.argsort(hop, kind='stable')
+    nsize = np.cumsum(np.bincount(hop, minlength=nhop+2))[:nhop+1]
+    return order[:nsize[-1]], nsize
+
+
+##  RGC blocks applied to a partition with halo
+def rgc_partition(rgclayer, node, edge, nnidx, nsize):
+    device = next(rgclayer.parameters()).device
+    node = torch.from_numpy(node).to(device)
+    edge = torch.from_numpy(edge).to(device)
+    nnidx = torch.from_numpy(nnidx).to(device)
+    niter = len(rgclayer)
+    with torch.inference_mode():
+        for i, f in enumerate(rgclayer):
+            n = nsize[niter-i-1]
+            node, edge = f(node, edge[:n], nnidx[:n])
+    return node.float().cpu().numpy()
+
+
+##  Sub-graph of a partition (node indices renumbered)
+def subgraph(node0, edge, nnidx, core, nhop):
+    nodes, nsize = halo_closure(nnidx, core, nhop)
+    local = np.zeros(len(nnidx), dtype=np.int64)
+    local[nodes] = np.arange(len(nodes))
+    # neighbors of the outermost nodes are never used
+    rows = nodes[:nsize[-2]] if nhop > 0 else nodes[:0]
+    return node0[nodes], edge[rows], local[nnidx[rows]], nsize
+
+
+##  Worker process
+_model, _bf16 = None, False
+def _init_worker(model, bf16=False):
+    global _model, _bf16
+    torch.set_num_threads(1)
+    _model, _bf16 = model, bf16
+
+def _rgc_task(task):
+    with torch.autocast(device_type='cpu', dtype=torch.bfloat16, enabled=_bf16):
+        return rgc_partition(_model.embedding.rgclayer, *task)
+
+
+##  bfloat16 autocast state on cpu (the device-type API of torch>=2.4, else the cpu-specific one)
+def _autocast_cpu_bf16():
+    if hasattr(torch, 'get_autocast_dtype'):
+        return torch.is_autocast_enabled('cpu') and torch.get_autocast_dtype('cpu') == torch.bfloat16
+    return torch.is_autocast_cpu_enabled() and torch.get_autocast_cpu_dtype() == torch.bfloat16
+
+
+##  Inference split into spatial partitions
+def partitioned_forward(model, node, edge, nnidx, coord, size=2000, nworkers=1):
+    """
+    Forward of GCNdesign (sparse input without segments) in which the RGC
+    blocks are applied to spatial partitions of at most 'size' residues,
+    each extended by the halo of niter_embed_rgc neighbor hops. The 1D
+    convolution modules (with instance normalization over the whole chain)
+    are applied to the whole input, so that the output is the same as the
+    forward of the whole graph. Partitions are processed in 'nworkers'
+    processes on cpu.
+
+    Note: with glibc, freed buffers of partitions of different sizes may
+    stay in the heap because of the dynamic mmap threshold. Setting e.g.
+    MALLOC_MMAP_THRESHOLD_=1048576 keeps the peak memory bounded by the
+    partition size.
+
+    Parameters
+    ----------
+    node, edge, nnidx : np.ndarray
+        (naa, 6) node features, (naa, nneighbor, 36) edge features & (naa, nneighbor) neighbor list.
+    coord : np.ndarray
+        (naa, 3) coordinates used for partitioning.
+    """
+    model.eval()
+    rgclayer = model.embedding.rgclayer
+    device = next(model.parameters()).device
+    with torch.inference_mode():
+        node0 = conv1d_segments(model.embedding.nodefeature0, torch.from_numpy(node).to(device)).cpu().numpy()
+    parts = spatial_partition(coord, size)
+    tasks = (subgraph(node0, edge, nnidx, core, len(rgclayer)) for core in parts)
+    multi = nworkers > 1 and len(parts) > 1 and device.type == 'cpu'
+    # workers follow the bfloat16 autocast of the caller
+    bf16 = _autocast_cpu_bf16()
+    pool = Pool(nworkers, initializer=_init_worker, initargs=(model, bf16)) if multi else None
+    outputs = pool.imap(_rgc_task, tasks) if pool else (rgc_partition(rgclayer, *task) for task in tasks)
+    latent = None
+    for core, out in zip(parts, outputs):
+        if latent is None:
+            latent = np.zeros((len(node), out.shape[1]), dtype=out.dtype)
+        latent[core] = out
+    if pool:
+        pool.close()
+        pool.join()
+    with torch.inference_mode():
+        return model.prediction(torch.from_numpy(latent).to(device))
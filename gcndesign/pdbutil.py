@@ -24,6 +24,8 @@ SOFTWARE.
 
 
 import sys
+import gzip
+import shlex
 import numpy as np
 
 class ProteinBackbone:
@@ -41,19 +43,23 @@ class ProteinBackbone:
     resname : numpy str vector (naa)
         Residue name.
     iaa2org : numpy str vector (naa)
-        Original chain ID and residue number.
+        Original chain ID, residue number and insertion code (see make_org & split_org).
     dihedral : numpy float matrix (naa, 3)
         Dihedral angles (phi, psi, omega).
     distmat : numpy float matrix (naa, naa)
-        Distance matrix.
+        Distance matrix (set by calc_distmat only; get_nearestN does not compute it).
     """
 
-    def __init__(self, length=0, file=None, copyfrom=None):
+    def __init__(self, length=0, file=None, copyfrom=None, model=None, chain=None):
         """
         Parameters
         ----------
         file : str
-            Path to the PDB file.
+            Path to the PDB or mmCIF file (gzip-compressed files are also accepted).
+        model : int
+            Model number to be read (default: the first model).
+        chain : str or list of str
+            Chain ID(s) to be read (default: all chains).
         copyfrom : instance of this class (ProteinBackbone).
             Original instance to be copied.
         length : int
@@ -68,7 +74,7 @@ class ProteinBackbone:
                        'length_CC':1.54, 'length_CO':1.24, 'length_NH':1.00}
         if file is not None:
             self.file = file
-            self.readpdb(self.file)
+            self.readpdb(self.file, model=model, chain=chain)
             self.addO()
         elif copyfrom is not None:
             self.naa = copyfrom.naa
@@ -83,7 +89,7 @@ class ProteinBackbone:
             self.exists[:,self.atom2id['CB']] = False
             self.exists[:,self.atom2id['H']] = False
             self.resname = ['NON']*self.naa
-            self.iaa2org = ['A0000']*self.naa
+            self.iaa2org = [make_org('A', 0)]*self.naa
 
     def __getitem__(self, ids):
         return self.coord[ids]
@@ -97,22 +103,16 @@ class ProteinBackbone:
     ## calc dihedral angle ##
     def calc_dihedral(self):
         self.dihedral = np.zeros((self.naa, 3), dtype=np.float)
-        for iaa in range(self.naa):
-            if (iaa > 0) and (self.exists[iaa-1][self.atom2id['C']] == True):
-                self.dihedral[iaa][0] = xyz2dihedral(self.coord[iaa-1][self.atom2id['C']],
-                                                     self.coord[iaa][self.atom2id['N']],
-                                                     self.coord[iaa][self.atom2id['CA']],
-                                                     self.coord[iaa][self.atom2id['C']])
-            if (iaa < self.naa-1) and (self.exists[iaa+1][self.atom2id['N']] == True):
-                self.dihedral[iaa][1] = xyz2dihedral(self.coord[iaa][self.atom2id['N']],
-                                                     self.coord[iaa][self.atom2id['CA']],
-                                                     self.coord[iaa][self.atom2id['C']],
-                                                     self.coord[iaa+1][self.atom2id['N']])
-            if (iaa < self.naa-1) and (self.exists[iaa+1][self.atom2id['CA']] == True):
-                self.dihedral[iaa][2] = xyz2dihedral(self.coord[iaa][self.atom2id['CA']],
-                                                     self.coord[iaa][self.atom2id['C']],
-                                                     self.coord[iaa+1][self.atom2id['N']],
-                                                     self.coord[iaa+1][self.atom2id['CA']])
+        N = self.coord[:,self.atom2id['N']]
+        CA = self.coord[:,self.atom2id['CA']]
+        C = self.coord[:,self.atom2id['C']]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            phi = xyz2dihedral_batch(C[:-1], N[1:], CA[1:], C[1:])
+            psi = xyz2dihedral_batch(N[:-1], CA[:-1], C[:-1], N[1:])
+            ome = xyz2dihedral_batch(CA[:-1], C[:-1], N[1:], CA[1:])
+        self.dihedral[1:,0] = np.where(self.exists[:-1,self.atom2id['C']], phi, 0.0)
+        self.dihedral[:-1,1] = np.where(self.exists[1:,self.atom2id['N']], psi, 0.0)
+        self.dihedral[:-1,2] = np.where(self.exists[1:,self.atom2id['CA']], ome, 0.0)
 
     ## delete residues ##
     def delete(self, position, length):
@@ -125,7 +125,7 @@ class ProteinBackbone:
         self.coord = np.zeros((self.naa, len(self.atom2id), 3), dtype=np.float)
         self.exists = np.zeros((self.naa, len(self.atom2id)), dtype=np.bool)
         self.resname = ['NAN']*self.naa
-        self.iaa2org = ['A0000']*self.naa
+        self.iaa2org = [make_org('A', 0)]*self.naa
         iaa_new = 0
         for iaa in range(naa_org):
             if position <= iaa < position+length: continue
@@ -148,7 +148,7 @@ class ProteinBackbone:
         self.exists[:,self.atom2id['CB']] = False
         self.exists[:,self.atom2id['H']] = False
         self.resname = [resname]*self.naa
-        self.iaa2org = [chain+'0000']*self.naa
+        self.iaa2org = [make_org(chain, 0)]*self.naa
         iaa_new = 0
         for iaa in range(naa_org):
             if iaa == position:
@@ -171,55 +171,49 @@ class ProteinBackbone:
 
     ## add vitual H atoms ##
     def addH(self, force=False):
-        for iaa in range(1,len(self.coord)):
-            if ((self.exists[iaa][self.atom2id['H']] == True) and (force==False)): continue
-            nh = zmat2xyz(self.param['length_NH'],
-                          self.param['angle_C_N_H'],
-                          self.param['dhdrl_CA_C_N_H'],
-                          self.coord[iaa-1][self.atom2id['CA']],
-                          self.coord[iaa-1][self.atom2id['C']],
-                          self.coord[iaa][self.atom2id['N']])
-            self.coord[iaa][self.atom2id['H']][0] = nh[0]
-            self.coord[iaa][self.atom2id['H']][1] = nh[1]
-            self.coord[iaa][self.atom2id['H']][2] = nh[2]
-            self.exists[iaa][self.atom2id['H']] = True
+        ids = np.arange(1, len(self.coord))
+        if force == False:
+            ids = ids[~self.exists[ids,self.atom2id['H']]]
+        self.coord[ids,self.atom2id['H']] = zmat2xyz_batch(self.param['length_NH'],
+                                                           self.param['angle_C_N_H'],
+                                                           self.param['dhdrl_CA_C_N_H'],
+                                                           self.coord[ids-1,self.atom2id['CA']],
+                                                           self.coord[ids-1,self.atom2id['C']],
+                                                           self.coord[ids,self.atom2id['N']])
+        self.exists[ids,self.atom2id['H']] = True
 
     ## add virtual O atoms ##
     def addO(self, force=False):
-        for iaa in range(len(self.coord)-1):
-            if ((self.exists[iaa][self.atom2id['O']] == True) and (force==False)): continue
-            co = zmat2xyz(self.param['length_CO'],
-                          self.param['angle_N_C_O'],
-                          self.param['dhdrl_CA_N_C_O'],
-                          self.coord[iaa+1][self.atom2id['CA']],
-                          self.coord[iaa+1][self.atom2id['N']],
-                          self.coord[iaa][self.atom2id['C']])
-            self.coord[iaa][self.atom2id['O']][0] = co[0]
-            self.coord[iaa][self.atom2id['O']][1] = co[1]
-            self.coord[iaa][self.atom2id['O']][2] = co[2]
-            self.exists[iaa][self.atom2id['O']] = True
+        ids = np.arange(len(self.coord)-1)
+        if force == False:
+            ids = ids[~self.exists[ids,self.atom2id['O']]]
+        self.coord[ids,self.atom2id['O']] = zmat2xyz_batch(self.param['length_CO'],
+                                                           self.param['angle_N_C_O'],
+                                                           self.param['dhdrl_CA_N_C_O'],
+                                                           self.coord[ids+1,self.atom2id['CA']],
+                                                           self.coord[ids+1,self.atom2id['N']],
+                                                           self.coord[ids,self.atom2id['C']])
+        self.exists[ids,self.atom2id['O']] = True
 
     ## add virtual CB atoms ##
     def addCB(self, force=False):
-        for iaa in range(len(self.coord)):
-            if ((self.exists[iaa][self.atom2id['CB']] == True) and (force==False)): continue
-            cb1 = zmat2xyz(self.param['length_CC'],
-                           self.param['angle_N_CA_CB'],
-                           self.param['dhdrl_C_N_CA_CB'],
-                           self.coord[iaa][self.atom2id['C']],
-                           self.coord[iaa][self.atom2id['N']],
-                           self.coord[iaa][self.atom2id['CA']])
-            cb2 = zmat2xyz(self.param['length_CC'],
-                           self.param['angle_CB_CA_C'],
-                           self.param['dhdrl_N_C_CA_CB'],
-                           self.coord[iaa][self.atom2id['N']],
-                           self.coord[iaa][self.atom2id['C']],
-                           self.coord[iaa][self.atom2id['CA']])
-            cb = (cb1 + cb2)/2.0
-            self.coord[iaa][self.atom2id['CB']][0] = cb[0]
-            self.coord[iaa][self.atom2id['CB']][1] = cb[1]
-            self.coord[iaa][self.atom2id['CB']][2] = cb[2]
-            self.exists[iaa][self.atom2id['CB']] = True
+        ids = np.arange(len(self.coord))
+        if force == False:
+            ids = ids[~self.exists[ids,self.atom2id['CB']]]
+        cb1 = zmat2xyz_batch(self.param['length_CC'],
+                             self.param['angle_N_CA_CB'],
+                             self.param['dhdrl_C_N_CA_CB'],
+                             self.coord[ids,self.atom2id['C']],
+                             self.coord[ids,self.atom2id['N']],
+                             self.coord[ids,self.atom2id['CA']])
+        cb2 = zmat2xyz_batch(self.param['length_CC'],
+                             self.param['angle_CB_CA_C'],
+                             self.param['dhdrl_N_C_CA_CB'],
+                             self.coord[ids,self.atom2id['N']],
+                             self.coord[ids,self.atom2id['C']],
+                             self.coord[ids,self.atom2id['CA']])
+        self.coord[ids,self.atom2id['CB']] = (cb1 + cb2)/2.0
+        self.exists[ids,self.atom2id['CB']] = True
 
     ## distance matrix ##
     def calc_distmat(self, atomtype='CA'):
@@ -228,16 +222,16 @@ class ProteinBackbone:
 
     ## get nearest N residues ##
     def get_nearestN(self, N, atomtype='CA', distmat=True, rm_self=True):
-        if distmat:
-            self.calc_distmat(atomtype=atomtype)
         if rm_self:
             N = N+1
-        args_topN_unsorted = np.argpartition(self.distmat, N)[:,:N]
-        args_topN_sorted = np.ndarray((self.distmat.shape[0], N), dtype=np.int)
-        for i in range(self.distmat.shape[0]):
-            vals = self.distmat[i][args_topN_unsorted[i]]
-            indices = np.argsort(vals)
-            args_topN_sorted[i] = args_topN_unsorted[i][indices]
+        if distmat:
+            # spatial index search (the dense distance matrix is not computed)
+            args_topN_sorted = nearestN(self.coord[:,self.atom2id[atomtype],:], N)
+        else:
+            # use pre-computed distance matrix (calc_distmat)
+            args_topN_unsorted = np.argpartition(self.distmat, N)[:,:N]
+            vals = np.take_along_axis(self.distmat, args_topN_unsorted, axis=1)
+            args_topN_sorted = np.take_along_axis(args_topN_unsorted, np.argsort(vals, axis=1), axis=1)
         if rm_self:
             args_topN_sorted = args_topN_sorted[:,1:]
         return args_topN_sorted
@@ -250,58 +244,198 @@ class ProteinBackbone:
         else:
             outrange = range(len(self.coord))
         for iaa in outrange:
-            if chain is None:
-                chain = self.iaa2org[iaa][0:1]
-            if start is None:
-                resnum = int(self.iaa2org[iaa][1:5])
-            else:
-                resnum = int(start) + iaa - outrange[0]
+            chain_out, resnum, icode = split_org(self.iaa2org[iaa])
+            if chain is not None:
+                chain_out = chain
+            if start is not None:
+                resnum, icode = int(start) + iaa - outrange[0], ''
+            assert len(chain_out) == 1 and -999 <= resnum <= 9999, \
+                "Chain {:s} & residue number {:d} do not fit the PDB format (give chain & start).".format(chain_out, resnum)
             for iatom in range(len(self.id2atom)):
                 if(self.exists[iaa][iatom] == False): continue
                 icount += 1
-                file.write("ATOM%7d  %-3s %3s %s%4d    %8.3f%8.3f%8.3f\n"
+                file.write("ATOM%7d  %-3s %3s %s%4d%1s   %8.3f%8.3f%8.3f\n"
                            % (icount, self.id2atom[iatom], self.resname[iaa],
-                              chain, resnum,
+                              chain_out, resnum, icode,
                               self.coord[iaa][iatom][0],
                               self.coord[iaa][iatom][1],
                               self.coord[iaa][iatom][2]))
 
     ## read pdb file ##
-    def readpdb(self, file):
-        lines = open(file, "r").read().splitlines()
-        # exists protein length
-        self.naa = 0
-        self.org2iaa = {}
-        for l in lines:
-            (header, atomtype, resname, chain, iaa_org) = (l[0:4], l[12:16].strip(), l[17:20], l[21:22], l[22:27])
-            if not ((header == "ATOM") and (atomtype == 'CA')) : continue
-            self.org2iaa[(chain+iaa_org)] = self.naa
-            self.naa += 1
-        # read ATOM lines
-        self.coord = np.zeros((self.naa, len(self.atom2id), 3), dtype=np.float)
-        self.exists = np.zeros((self.naa, len(self.atom2id)), dtype=np.bool)
-        self.resname = ['NAN']*self.naa
-        self.iaa2org = ['A0000 ']*self.naa
-        for l in lines:
-            (header, atomtype, resname, chain, iaa_org) = (l[0:4], l[12:16].strip(), l[17:20], l[21:22], l[22:27])
-            if not (header == "ATOM"): continue
-            if atomtype not in self.atom2id: continue
-            org = (chain+iaa_org)
-            iaa = self.org2iaa.get(org)
-            if iaa is None: continue
-            id_atom = self.atom2id[atomtype]
-            coord = [float(l[30:38]), float(l[38:46]), float(l[46:54])]
-            self.coord[iaa][id_atom][0] = coord[0]
-            self.coord[iaa][id_atom][1] = coord[1]
-            self.coord[iaa][id_atom][2] = coord[2]
-            self.exists[iaa][id_atom] = True
-            self.resname[iaa] = resname
-            self.iaa2org[iaa] = org
+    def readpdb(self, file, model=None, chain=None, hetatm=True):
+        atoms = read_atoms(file)
+        # model & chain selection
+        if model is None:
+            model = atoms['model'][0] if len(atoms['model']) > 0 else 0
+        sel = (atoms['model'] == model) & np.isin(atoms['atom'], self.id2atom)
+        if chain is not None:
+            sel &= np.isin(atoms['chain'], list(chain))
+        if not hetatm:
+            sel &= (atoms['group'] == 'ATOM')
+        atoms = {k:v[sel] for k, v in atoms.items()}
+        names, id_atom = np.unique(atoms['atom'], return_inverse=True)
+        id_atom = np.array([self.atom2id[a] for a in names], dtype=np.int64)[id_atom]
+        orgs, id_org = np.unique(atoms['org'], return_inverse=True)
+        # first record of each atom (alternate locations)
+        _, first = np.unique(id_org*len(self.id2atom) + id_atom, return_index=True)
+        first = np.sort(first)
+        atoms = {k:v[first] for k, v in atoms.items()}
+        id_atom, id_org = id_atom[first], id_org[first]
+        # residues in order of CA records
+        is_ca = (id_atom == self.atom2id['CA'])
+        naa = np.sum(is_ca)
+        res_of_org = np.full(len(orgs), -1, dtype=np.int64)
+        res_of_org[id_org[is_ca]] = np.arange(naa)
+        iaa = res_of_org[id_org]
+        coord = np.zeros((naa, len(self.atom2id), 3), dtype=np.float64)
+        exists = np.zeros((naa, len(self.atom2id)), dtype=bool)
+        coord[iaa[iaa>=0], id_atom[iaa>=0]] = atoms['xyz'][iaa>=0]
+        exists[iaa[iaa>=0], id_atom[iaa>=0]] = True
+        # HETATM residues (modified amino acids) must have N, CA & C atoms
+        keep = (atoms['group'][is_ca] == 'ATOM') | (exists[:,self.atom2id['N']] & exists[:,self.atom2id['C']])
+        resname = [modified_residues.get(r, r) if g == 'HETATM' else r
+                   for r, g in zip(atoms['resname'][is_ca][keep], atoms['group'][is_ca][keep])]
+        # set
+        self.naa = int(np.sum(keep))
+        self.coord = coord[keep]
+        self.exists = exists[keep]
+        self.resname = resname
+        self.iaa2org = list(atoms['org'][is_ca][keep])
+        self.org2iaa = {org:i for i, org in enumerate(self.iaa2org)}
         return
 
 
 
 #### Functions ####
+##  Original residue id: chain ID (1 char) + residue number (4) + insertion
+##  code (1) as in PDB columns 22-27; ids not fitting this layout (e.g.
+##  multi-character chains or residue numbers > 9999 of mmCIF) are joined
+##  by '|'. Placeholders of inserted residues have no insertion code.
+def make_org(chain, resnum, icode=''):
+    resnum = str(resnum)
+    if len(chain) == 1 and len(resnum) <= 4 and len(icode) <= 1:
+        return chain + resnum.rjust(4) + icode
+    return '|'.join([chain, resnum, icode])
+
+def split_org(org):
+    # (chain, resnum, icode) of an original residue id
+    if '|' in org:
+        chain, resnum, icode = org.split('|')
+    else:
+        chain, resnum, icode = org[:1], org[1:5], org[5:]
+    return chain, int(resnum), icode.strip()
+
+def residue_ids(iaa2org):
+    # ids as in resfile.expand_nums ('12A': residue number + chain ID)
+    return ['{:d}{:s}'.format(resnum, chain) for chain, resnum, _ in map(split_org, iaa2org)]
+
+# modified amino-acid residues (HETATM) to standard residues
+modified_residues = {'MSE':'MET', 'MLY':'LYS', 'M3L':'LYS', 'SEP':'SER', 'TPO':'THR',
+                     'PTR':'TYR', 'HYP':'PRO', 'CSO':'CYS', 'CSD':'CYS', 'CME':'CYS',
+                     'KCX':'LYS', 'LLP':'LYS', 'PCA':'GLN', 'MEN':'ASN', 'FME':'MET'}
+
+def read_atoms(file):
+    """
+    Read atom records of a PDB or mmCIF file (optionally gzip-compressed)
+    into column arrays: group, atom, resname, chain, org (chain ID +
+    residue number + insertion code), model & xyz.
+    """
+    with open(file, 'rb') as f:
+        data = f.read()
+    if data[:2] == b'\x1f\x8b':
+        data = gzip.decompress(data)
+    if data.lstrip()[:5] == b'data_':
+        return _read_atoms_mmcif(data)
+    return _read_atoms_pdb(data)
+
+def _read_atoms_pdb(data):
+    lines = np.array(data.splitlines(), dtype='S80')
+    chars = lines.view('S1').reshape(len(lines), 80)
+    col = lambda ini, end: np.ascontiguousarray(chars[:,ini:end]).view('S{:d}'.format(end-ini))[:,0]
+    # model numbers
+    header = col(0, 6)
+    is_model = (header == b'MODEL ')
+    models = np.array([int(v) for v in col(10, 14)[is_model]] or [0], dtype=np.int64)
+    imodel = np.cumsum(is_model) - 1
+    # atom records
+    is_atom = (header == b'ATOM  ') | (header == b'HETATM')
+    chars = chars[is_atom]
+    names, id_name = np.unique(col(12, 16), return_inverse=True)
+    atoms = {
+        'group': np.where(header[is_atom] == b'HETATM', 'HETATM', 'ATOM'),
+        'atom': np.char.strip(names).astype(str)[id_name],
+        'resname': col(17, 20).astype(str),
+        'chain': col(21, 22).astype(str),
+        'org': col(21, 27).astype(str),
+        'model': models[np.maximum(imodel[is_atom], 0)],
+        'xyz': np.stack([col(30, 38), col(38, 46), col(46, 54)], axis=1).astype(np.float64)
+    }
+    return atoms
+
+def _read_atoms_mmcif(data):
+    lines = data.decode().splitlines()
+    ini = next(i for i, l in enumerate(lines) if l.startswith('_atom_site.'))
+    end = ini
+    while lines[end].startswith('_atom_site.'):
+        end += 1
+    fields = {l.strip()[len('_atom_site.'):]:i for i, l in enumerate(lines[ini:end])}
+    rows = []
+    for l in lines[end:]:
+        if l.startswith(('#', 'loop_', '_', 'data_')): break
+        rows.append(l)
+    tokens = ' '.join(rows).split()
+    if len(tokens) == len(rows)*len(fields):
+        table = np.array(tokens).reshape(len(rows), len(fields))
+    else:
+        table = np.array([shlex.split(l) for l in rows])
+    def col(*names, default=''):
+        for name in names:
+            if name in fields:
+                return table[:,fields[name]]
+        return np.full(len(table), default)
+    seqnum = col('auth_seq_id', 'label_seq_id')
+    icode = col('pdbx_PDB_ins_code', default='?')
+    icode = np.where(np.isin(icode, ['?', '.']), ' ', icode)
+    chain = col('auth_asym_id', 'label_asym_id')
+    # PDB layout if it fits (cf. make_org)
+    fits = (np.char.str_len(chain) == 1) & (np.char.str_len(seqnum) <= 4)
+    org = np.where(fits, np.char.add(np.char.add(chain, np.char.rjust(seqnum, 4)), icode),
+                   np.char.add(np.char.add(np.char.add(chain, '|'), np.char.add(seqnum, '|')), np.char.strip(icode)))
+    atoms = {
+        'group': col('group_PDB', default='ATOM'),
+        'atom': np.char.strip(col('auth_atom_id', 'label_atom_id'), '"'),
+        'resname': col('auth_comp_id', 'label_comp_id'),
+        'chain': chain,
+        'org': org,
+        'model': col('pdbx_PDB_model_num', default='0').astype(np.int64),
+        'xyz': np.stack([col('Cartn_x'), col('Cartn_y'), col('Cartn_z')], axis=1).astype(np.float64)
+    }
+    return atoms
+
+def nearestN(points, N, chunk=1024):
+    """
+    Indices of the N nearest points for each point, sorted by distance.
+    KD-tree search is used if scipy is available, otherwise distances are
+    computed in row chunks to keep memory bounded.
+    """
+    assert N < len(points), \
+        "Number of neighbors ({:d}) must be smaller than the number of residues ({:d}).".format(N, len(points))
+    # scipy is imported on first use (start-up time)
+    try:
+        from scipy.spatial import cKDTree
+    except ModuleNotFoundError:
+        cKDTree = None
+    if cKDTree is not None:
+        _, args = cKDTree(points).query(points, k=N)
+        return args.reshape(len(points), N).astype(np.int64)
+    args = np.zeros((len(points), N), dtype=np.int64)
+    for ini in range(0, len(points), chunk):
+        dist = np.sqrt( np.sum((points[np.newaxis,:,:] - points[ini:ini+chunk,np.newaxis,:])**2, axis=2) )
+        args_unsorted = np.argpartition(dist, N)[:,:N]
+        vals = np.take_along_axis(dist, args_unsorted, axis=1)
+        args[ini:ini+chunk] = np.take_along_axis(args_unsorted, np.argsort(vals, axis=1), axis=1)
+    return args
+
 def zmat2xyz(bond, angle, dihedral, one, two , three):
     oldvec = np.ones(4, dtype=np.float)
     oldvec[0] = bond * np.sin(angle) * np.sin(dihedral)
@@ -357,3 +491,50 @@ def xyz2dihedral(p1, p2, p3, p4):
     angle = np.rad2deg( np.arccos(scp) )
     # return #
     return angle if np.dot(v1, perp234) > 0 else -angle
+
+
+#### Vectorized functions ####
+#  Coordinates are arrays of shape (..., 3); any leading dimensions
+#  (residues, or structures x residues) are processed at once.
+def zmat2xyz_batch(bond, angle, dihedral, one, two, three):
+    x, y, z = viewat_batch(three, two, one)
+    vec_x = np.asarray(bond * np.sin(angle) * np.sin(dihedral))[...,np.newaxis]
+    vec_y = np.asarray(bond * np.sin(angle) * np.cos(dihedral))[...,np.newaxis]
+    vec_z = np.asarray(bond * np.cos(angle))[...,np.newaxis]
+    # return
+    return vec_x * x + vec_y * y + vec_z * z + three
+
+def viewat_batch(p1, p2, p3):
+    # vector #
+    p12 = p2 - p1
+    p13 = p3 - p1
+    # normalize #
+    z = p12 / np.linalg.norm(p12, axis=-1, keepdims=True)
+    # crossproduct #
+    x = np.cross(p13, p12)
+    x /= np.linalg.norm(x, axis=-1, keepdims=True)
+    y = np.cross(z, x)
+    y /= np.linalg.norm(y, axis=-1, keepdims=True)
+    # return axes of the local frame
+    return x, y, z
+
+def xyz2dihedral_batch(p1, p2, p3, p4):
+    # small val #
+    eps = 0.0000001
+    # bond vector
+    v1 = p2 - p1
+    v2 = p3 - p2
+    v3 = p4 - p3
+    # perpendicular vector #
+    perp123 = np.cross(v1, v2)
+    perp234 = np.cross(v2, v3)
+    perp123 /= np.linalg.norm(perp123, axis=-1, keepdims=True)
+    perp234 /= np.linalg.norm(perp234, axis=-1, keepdims=True)
+    # scalar product #
+    scp = np.sum(perp123 * perp234, axis=-1)
+    scp = np.where((1-eps < scp) & (scp < 1+eps), scp - eps, scp)
+    scp = np.where((-1-eps < scp) & (scp < -1+eps), scp + eps, scp)
+    # absolute angle #
+    angle = np.rad2deg( np.arccos(scp) )
+    # return #
+    return np.where(np.sum(v1 * perp234, axis=-1) > 0, angle, -angle)
@@ -2,9 +2,12 @@ from os import path
 import numpy as np
 import torch
 from .hypara import HyperParam, InputSource
-from .models import GCNdesign
+from .weights import load_model
 from .dataset import pdb2input, add_margin
-from .pdbutil import ProteinBackbone
+from .pdbutil import ProteinBackbone, split_org, residue_ids
+from .models import precision_autocast
+# export, partition, ensemble, sampler, incremental, cache & multiprocessing
+# are imported where they are used (short start-up of plain prediction)
 
 # int code to amino-acid types
 i2aa = ('A', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'K', 'L',
@@ -24,67 +27,281 @@ def eliminate_restype(prob, unused):
 # for default paramfile
 source = InputSource()
 
+def featurize(pdb, hypara):
+    # pdb: file or ProteinBackbone
+    pbb = pdb if isinstance(pdb, ProteinBackbone) else ProteinBackbone(file=pdb)
+    node, edge, nnidx, label, mask, aa1 = pdb2input(pbb, hypara, sparse=True)
+    node, edge, nnidx, label, mask = add_margin(node, edge, nnidx, label, mask, hypara.nneighbor)
+    # CA coordinates (margins at the terminal residues) for spatial partitioning
+    ca = pbb.coord[:, pbb.atom2id['CA']]
+    coord = np.concatenate([ca[:1], ca, ca[-1:]]).astype(np.float32)
+    return {'node': node.astype(np.float32), 'edge': edge.astype(np.float32), 'nnidx': nnidx,
+            'label': label, 'mask': mask, 'aa1': np.array(list(aa1)), 'iaa2org': np.array(pbb.iaa2org),
+            'coord': coord}
+
+def _featurize_task(task):
+    return featurize(*task)
+
 class Predictor():
-    def __init__(self, device: str=None, param: str=None, hypara=None):
+    def __init__(self, device: str=None, param: str=None, hypara=None, cache=None, quantize: str=None,
+                 partition_size: int=None, partition_workers: int=1, ensemble: list=None, precision: str=None):
         # device
         if not device:
             device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.hypara = hypara if hypara else HyperParam()
-        self.param = param if param else InputSource().param_in
+        self.param = param if param else (ensemble[0] if ensemble else InputSource().param_in)
         self.device = device
         # model setup
         assert path.isfile(self.param), "Parameter file {:s} was not found.".format(self.param)
-        self.model = torch.load(self.param, map_location=torch.device(self.device))
+        hypara_model = None
+        from .export import is_torchscript
+        if is_torchscript(self.param):
+            # exported (folded & traced) model
+            self.model = torch.jit.load(self.param, map_location=torch.device(self.device))
+        else:
+            # versioned parameter file (hyperparameters included) or pickled model
+            self.model, hypara_model = load_model(self.param, self.device)
+        self.hypara = hypara if hypara else (hypara_model if hypara_model else HyperParam())
+        self.scripted = isinstance(self.model, torch.jit.ScriptModule)
+        # int8 dynamic quantization (CPU)
+        self.quantize = quantize
+        if quantize:
+            assert self.device == 'cpu', "Quantized model runs only on cpu."
+            assert not self.scripted, "Exported model {:s} cannot be quantized.".format(self.param)
+            from .export import quantize_model
+            self.model = quantize_model(self.model, quantize)
+        # bfloat16 autocast of the GCN blocks
+        self.precision = precision
+        assert not (precision == 'bf16' and (quantize or self.scripted)), \
+            "bf16 precision is not applied to quantized or exported models."
+        # partitioned inference of large structures
+        self.partition_size = partition_size
+        self.partition_workers = partition_workers
+        assert not (partition_size and self.scripted), "Exported model {:s} does not support partitioned inference.".format(self.param)
+        # ensemble members (parameter files)
+        self.ensemble = None
+        if ensemble:
+            for param in ensemble:
+                assert path.isfile(param), "Parameter file {:s} was not found.".format(param)
+            from .ensemble import ModelEnsemble
+            # the model of self.param is shared unless it was quantized or exported
+            reuse = not (quantize or self.scripted)
+            self.ensemble = ModelEnsemble([self.model if reuse and path.samefile(param, self.param)
+                                           else load_model(param, self.device)[0] for param in ensemble])
+        # cache of features & logits
+        self.cache = cache
+        self.param_hash = None
+        if cache is not None:
+            from .cache import file_hash
+            self.param_hash = file_hash(self.param) + (quantize or '') + (precision or '')
         return
 
-    def _pred_base(self, pdb: str):
-        # input data setup
-        dat1, dat2, dat3, label, mask, aa1 = pdb2input(pdb, self.hypara)
-        dat1, dat2, dat3, label, mask = add_margin(dat1, dat2, dat3, label, mask, self.hypara.nneighbor)
-        dat1 = torch.FloatTensor(dat1).squeeze().to(self.device)
-        dat2 = torch.FloatTensor(dat2).squeeze().to(self.device)
-        dat3 = torch.BoolTensor(dat3).squeeze().to(self.device)
-        label = torch.LongTensor(label).squeeze().to(self.device)
-        mask = torch.BoolTensor(mask).squeeze().to(self.device)
+    def _forward(self, entries):
+        # traced models take no segments: one structure per forward
+        if self.scripted and len(entries) > 1:
+            return [logit for e in entries for logit in self._forward([e])]
+        # large structures are split into spatial partitions
+        if self.partition_size and any(len(e['node']) > self.partition_size for e in entries):
+            if len(entries) > 1:
+                return [logit for e in entries for logit in self._forward([e])]
+            e = entries[0]
+            from .partition import partitioned_forward
+            with precision_autocast(self.device, self.precision):
+                outputs = partitioned_forward(self.model, e['node'], e['edge'], e['nnidx'], e['coord'],
+                                              size=self.partition_size, nworkers=self.partition_workers)
+            return [outputs[1:-1].cpu().numpy()]
+        # featurized entries are concatenated into one graph (neighbor indices shifted)
+        lengths = [len(e['node']) for e in entries]
+        offsets = np.cumsum([0] + lengths[:-1])
+        dat1 = torch.from_numpy(np.concatenate([e['node'] for e in entries])).to(self.device)
+        dat2 = torch.from_numpy(np.concatenate([e['edge'] for e in entries])).to(self.device)
+        dat3 = torch.from_numpy(np.concatenate([e['nnidx'] + o for e, o in zip(entries, offsets)])).long().to(self.device)
         # prediction
         self.model.eval()
-        outputs = self.model(dat1, dat2, dat3)[1:-1]
+        with torch.inference_mode(), precision_autocast(self.device, self.precision):
+            if len(entries) > 1:
+                outputs = self.model(dat1, dat2, dat3, segments=lengths)
+            else:
+                outputs = self.model(dat1, dat2, dat3)
+        # logits without margins
+        return [o[1:-1].cpu().numpy() for o in torch.split(outputs, lengths)]
+
+    def _pred_base(self, pdb: str):
+        # cached features & logits
+        key = self.cache.key(pdb, self.param_hash, self.hypara) if self.cache is not None else None
+        entry = self.cache.get(key) if key else None
+        if entry is None:
+            entry = featurize(pdb, self.hypara)
+            entry['logit'] = self._forward([entry])[0]
+            if key:
+                self.cache.put(key, entry)
         # return
-        return outputs, aa1
+        return torch.from_numpy(entry['logit']), list(entry['aa1']), list(entry['iaa2org'])
+
+    def _pred_batch(self, pdbs, nworkers: int=1, batch_residues: int=4000):
+        # featurize in workers (cached entries are skipped), run residue-budgeted batches
+        pdbs = list(pdbs)
+        for pdb in pdbs:
+            assert path.isfile(pdb), "PDB file {:s} was not found.".format(pdb)
+        keys = [self.cache.key(pdb, self.param_hash, self.hypara) if self.cache is not None else None for pdb in pdbs]
+        entries = [self.cache.get(key) if key else None for key in keys]
+        todo = [i for i, e in enumerate(entries) if e is None]
+        tasks = [(pdbs[i], self.hypara) for i in todo]
+        from multiprocessing import Pool
+        pool = Pool(nworkers) if nworkers > 1 and len(tasks) > 1 else None
+        featurized = pool.imap(_featurize_task, tasks) if pool else map(_featurize_task, tasks)
+        batch, nres = [], 0
+        for count, (i, entry) in enumerate(zip(todo, featurized), 1):
+            entries[i] = entry
+            batch.append(i)
+            nres += len(entry['node'])
+            if nres < batch_residues and count < len(todo): continue
+            for j, logit in zip(batch, self._forward([entries[j] for j in batch])):
+                entries[j]['logit'] = logit
+                if keys[j]:
+                    self.cache.put(keys[j], entries[j])
+            batch, nres = [], 0
+        if pool:
+            pool.close()
+            pool.join()
+        return [(torch.from_numpy(e['logit']), list(e['aa1']), list(e['iaa2org'])) for e in entries]
 
     def predict_logit_tensor(self, pdb: str, as_dict=False):
         # check pdb file
         assert path.isfile(pdb), "PDB file {:s} was not found.".format(pdb)
         # pred
-        logit, _ = self._pred_base(pdb)
+        logit, _, _ = self._pred_base(pdb)
         logit = logit.detach().cpu().numpy()
         # return summary
         return [dict(zip(i2aa, l)) for l in logit] if as_dict else logit
 
-    def predict(self, pdb: str, temperature: float=1.0):
+    def predict_logit_batch(self, pdbs, as_dict=False, nworkers: int=1, batch_residues: int=4000):
+        results = self._pred_batch(pdbs, nworkers=nworkers, batch_residues=batch_residues)
+        # return summary (in input order)
+        logits = [logit.numpy() for logit, _, _ in results]
+        return [[dict(zip(i2aa, l)) for l in logit] for logit in logits] if as_dict else logits
+
+    def sampler(self, pdb: str):
         # check pdb file
         assert path.isfile(pdb), "PDB file {:s} was not found.".format(pdb)
+        # sequence sampler & scorer over the (cached) logits
+        logit, aa1, iaa2org = self._pred_base(pdb)
+        from .sampler import SequenceSampler
+        return SequenceSampler(logit.detach().cpu().numpy(), aa1, iaa2org)
+
+    def _local_entry(self, pdb):
+        # featurized entry with the intermediate activations (cached for files)
+        from .incremental import local_forward
+        assert not self.scripted, "Exported model {:s} does not support local prediction.".format(self.param)
+        key = self.cache.key(pdb, self.param_hash, self.hypara) if self.cache is not None and isinstance(pdb, str) else None
+        entry = self.cache.get(key) if key else None
+        if entry is None or 'latent' not in entry:
+            entry = featurize(pdb, self.hypara) if entry is None else dict(entry)
+            entry = local_forward(self.model, entry)
+            if key:
+                self.cache.put(key, entry)
+        return entry
+
+    def predict_logit_local(self, pdb, reference=None, residues=None, tol: float=0.0, restrict: bool=False):
+        """
+        Logits of the residues (e.g. {'12A', '13A'}, cf. resfile.expand_nums;
+        all residues by default) of a structure (file or ProteinBackbone),
+        with the RGC blocks applied only to the receptive field of the changes
+        from the reference (file, ProteinBackbone or an entry returned before).
+        With tol=0 (default) the logits are the same as those of the forward
+        of the whole structure. With 'residues' & a reference, the
+        recomputation is restricted to the rows the logits of these residues
+        depend on (other rows are marked 'stale') only if tol > 0 or
+        restrict=True; the result is then approximate, as the prediction
+        module normalizes over the whole chain. Without a reference, the
+        whole structure is computed & 'residues' only selects the logits.
+        See incremental.local_forward for 'tol' & 'targets'.
+
+        Returns the logits & the entry, which can be the reference of the
+        next edit ('nrecomputed' & 'deviation' tell the recomputed rows &
+        the largest difference of the reused ones).
+        """
+        if isinstance(pdb, str):
+            assert path.isfile(pdb), "PDB file {:s} was not found.".format(pdb)
+        if reference is None:
+            entry = self._local_entry(pdb)
+        else:
+            from .incremental import local_forward
+            ref = reference if isinstance(reference, dict) else self._local_entry(reference)
+            entry = featurize(pdb, self.hypara)
+            targets = None
+            if residues is not None and (tol > 0 or restrict):
+                targets = np.array([i+1 for i, v in enumerate(residue_ids(entry['iaa2org'])) if v in residues], dtype=np.int64)
+            entry = local_forward(self.model, entry, ref, tol, targets)
+            # only exact results are cached
+            if self.cache is not None and isinstance(pdb, str) and entry['deviation'] == 0 and not entry['stale'].any():
+                self.cache.put(self.cache.key(pdb, self.param_hash, self.hypara), entry)
+        logit = entry['logit']
+        if residues is not None:
+            logit = logit[[i for i, v in enumerate(residue_ids(entry['iaa2org'])) if v in residues]]
+        return logit, entry
+
+    def _summary(self, logit, aa1, iaa2org, temperature: float=1.0):
         # original resnum
-        pbb = ProteinBackbone(file=pdb)
-        id2org = [(int(v[1:]), v[0]) for v in pbb.iaa2org]
-        # pred
-        logit, aa1 = self._pred_base(pdb)
+        id2org = [(resnum, chain) for chain, resnum, _ in map(split_org, iaa2org)]
         # convert to probabiality
         prob = torch.softmax(logit/temperature, dim=1).detach().cpu().numpy()
         # return summary
         pdict = [dict(zip(i2aa, p)) for p in prob]
         return [(p, {'resnum':v[0],'chain':v[1],'original':a}) for p,v,a in zip(pdict, id2org, aa1)]
 
+    def predict(self, pdb: str, temperature: float=1.0):
+        # check pdb file
+        assert path.isfile(pdb), "PDB file {:s} was not found.".format(pdb)
+        # pred
+        logit, aa1, iaa2org = self._pred_base(pdb)
+        return self._summary(logit, aa1, iaa2org, temperature)
+
+    def predict_batch(self, pdbs, temperature: float=1.0, nworkers: int=1, batch_residues: int=4000):
+        results = self._pred_batch(pdbs, nworkers=nworkers, batch_residues=batch_residues)
+        return [self._summary(logit, aa1, iaa2org, temperature) for logit, aa1, iaa2org in results]
+
+    def predict_prob_ensemble(self, pdb: str, mc_samples: int=1, temperature: float=1.0, batched: bool=None):
+        # check pdb file
+        assert path.isfile(pdb), "PDB file {:s} was not found.".format(pdb)
+        # members: ensemble or the model itself (for MC-dropout)
+        if self.ensemble is None:
+            assert not self.scripted, "Exported model {:s} has no dropout layers.".format(self.param)
+            from .ensemble import ModelEnsemble
+            self.ensemble = ModelEnsemble([self.model])
+        batched = self.device != 'cpu' if batched is None else batched
+        # featurized once (cached features are reused)
+        key = self.cache.key(pdb, self.param_hash, self.hypara) if self.cache is not None else None
+        entry = self.cache.get(key) if key else None
+        entry = entry if entry is not None else featurize(pdb, self.hypara)
+        dat1 = torch.from_numpy(entry['node']).to(self.device)
+        dat2 = torch.from_numpy(entry['edge']).to(self.device)
+        dat3 = torch.from_numpy(entry['nnidx']).long().to(self.device)
+        logits = self.ensemble.forward(dat1, dat2, dat3, mc_samples=mc_samples, batched=batched)[:, 1:-1]
+        # mean & variance of probabilities over members & samples
+        prob = torch.softmax(logits/temperature, dim=-1)
+        mean, var = prob.mean(0), prob.var(0, unbiased=False)
+        return mean.cpu().numpy(), var.cpu().numpy(), list(entry['aa1']), list(entry['iaa2org'])
+
+    def predict_ensemble(self, pdb: str, mc_samples: int=1, temperature: float=1.0, batched: bool=None):
+        mean, var, aa1, iaa2org = self.predict_prob_ensemble(pdb, mc_samples, temperature, batched)
+        # original resnum
+        id2org = [(resnum, chain) for chain, resnum, _ in map(split_org, iaa2org)]
+        # return summary
+        return [(dict(zip(i2aa, m)), dict(zip(i2aa, v)), {'resnum':o[0],'chain':o[1],'original':a})
+                for m, v, o, a in zip(mean, var, id2org, aa1)]
+
     def make_resfile(self, pdb: str, temperature: float=1.0, prob_cut: float=0.8, unused=None):
         # check pdb file
         assert path.isfile(pdb), "PDB file {:s} was not found.".format(pdb)
+        # pred
+        logit, aa1, iaa2org = self._pred_base(pdb)
+        return self._resfile(logit, aa1, iaa2org, temperature, prob_cut, unused)
+
+    def _resfile(self, logit, aa1, iaa2org, temperature: float=1.0, prob_cut: float=0.8, unused=None):
         # restypes not to be used
         unused = [] if unused==None else unused
         # original resnum
-        pbb = ProteinBackbone(file=pdb)
-        id2org = [(int(v[1:]), v[0]) for v in pbb.iaa2org]
-        # pred
-        logit, aa1 = self._pred_base(pdb)
+        id2org = [(resnum, chain) for chain, resnum, _ in map(split_org, iaa2org)]
         # convert to probabiality
         prob = torch.softmax(logit/temperature, dim=1).detach().cpu().numpy()
         # eliminate non-used restypes
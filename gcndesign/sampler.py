@@ -0,0 +1,114 @@
+import numpy as np
+from .pdbutil import residue_ids
+
+# int code to amino-acid types (same as predictor)
+i2aa = ('A', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'K', 'L',
+        'M', 'N', 'P', 'Q', 'R', 'S', 'T', 'V', 'W', 'Y')
+aa2i = {aa:i for i, aa in enumerate(i2aa)}
+
+# one-letter code (byte) -> int code (-1 for others)
+_lookup = np.full(256, -1, dtype=np.int64)
+_lookup[np.frombuffer(''.join(i2aa).encode(), dtype=np.uint8)] = np.arange(len(i2aa))
+
+
+def encode(seqs):
+    # list of sequences (same length) -> int array (nseq, naa)
+    seqs = [seqs] if isinstance(seqs, str) else list(seqs)
+    length = len(seqs[0]) if seqs else 0
+    assert all(len(s) == length for s in seqs), "Sequences must have the same length."
+    codes = np.frombuffer(''.join(seqs).encode(), dtype=np.uint8).reshape(len(seqs), length)
+    return _lookup[codes]
+
+
+def decode(codes):
+    # int array (nseq, naa) -> list of sequences
+    chars = np.array(i2aa, dtype='S1')[np.asarray(codes)]
+    return [row.tobytes().decode() for row in chars.reshape(len(chars), -1)]
+
+
+##  Sequence sampling & scoring over the logits of a backbone
+class SequenceSampler:
+    """
+    Draws & scores amino-acid sequences with array operations on the
+    (naa, 20) logits predicted once for a backbone.
+
+    Parameters
+    ----------
+    logit : np.ndarray
+        (naa, 20) logits (e.g. Predictor.predict_logit_tensor).
+    aa1 : list
+        Native one-letter residue types (for kept positions).
+    iaa2org : list
+        Original residue ids (for positions given by residue number & chain).
+    """
+
+    def __init__(self, logit, aa1=None, iaa2org=None):
+        self.logit = np.asarray(logit, dtype=np.float32)
+        self.aa1 = list(aa1) if aa1 is not None else None
+        self.iaa2org = list(iaa2org) if iaa2org is not None else None
+
+    def __len__(self):
+        return len(self.logit)
+
+    def positions(self, resnums):
+        # indices of residues given as {'1A', '12B', ...} (cf. resfile.expand_nums)
+        assert self.iaa2org is not None, "Residue ids are required."
+        ids = residue_ids(self.iaa2org)
+        return np.array([i for i, v in enumerate(ids) if v in resnums], dtype=np.int64)
+
+    def log_prob(self, temperature=1.0, unused=None):
+        """
+        Log-probabilities (ntemp, naa, 20) for temperature(s) (ntemp,), or
+        (naa, 20) for a scalar temperature. Unused residue types are
+        excluded (-inf) and the rest are renormalized.
+        """
+        temperature = np.asarray(temperature, dtype=np.float32)
+        logit = self.logit / temperature.reshape(-1, 1, 1)
+        if unused:
+            logit[:, :, [aa2i[aa] for aa in unused]] = -np.inf
+        logit = logit - logit.max(axis=-1, keepdims=True)
+        logp = logit - np.log(np.exp(logit).sum(axis=-1, keepdims=True))
+        return logp if temperature.ndim > 0 else logp[0]
+
+    def sample(self, nseq, temperature=1.0, unused=None, keep=None, seed=None, chunk=1024):
+        """
+        Draws nseq sequences (Gumbel-max sampling) as an int array (nseq, naa).
+        'temperature' is a scalar or an array (nseq,). Positions in 'keep'
+        (indices or boolean mask) are fixed to the native residue types.
+        """
+        rng = np.random.default_rng(seed)
+        temperature = np.broadcast_to(np.asarray(temperature, dtype=np.float32), (nseq,))
+        codes = np.empty((nseq, len(self)), dtype=np.int64)
+        for ini in range(0, nseq, chunk):
+            temp = temperature[ini:ini+chunk]
+            # temperatures shared in a chunk are computed once
+            uniq, inv = np.unique(temp, return_inverse=True)
+            logp = self.log_prob(uniq, unused)[inv]
+            u = rng.random(logp.shape, dtype=np.float32)
+            gumbel = -np.log(-np.log(np.clip(u, 1e-20, 1.0)))
+            codes[ini:ini+chunk] = np.argmax(logp + gumbel, axis=-1)
+        if keep is not None and len(keep) > 0:
+            assert self.aa1 is not None, "Native sequence is required to keep positions."
+            native = encode(''.join(self.aa1))[0]
+            keep = np.flatnonzero(keep) if np.asarray(keep).dtype == bool else np.asarray(keep)
+            assert np.all(native[keep] >= 0), "Kept positions include non-standard residues."
+            codes[:, keep] = native[keep]
+        return codes
+
+    def sample_sequences(self, nseq, temperature=1.0, unused=None, keep=None, seed=None):
+        return decode(self.sample(nseq, temperature, unused, keep, seed))
+
+    def score(self, seqs, temperature=1.0, unused=None, per_residue=False):
+        """
+        Log-likelihoods (nseq,) of sequences (strings or int array (nseq, naa)),
+        or (nseq, naa) per residue. 'temperature' is a scalar or an array
+        (nseq,). Residue types other than the 20 types (or unused ones) give -inf.
+        """
+        codes = encode(seqs) if isinstance(seqs, str) or isinstance(seqs[0], str) else np.asarray(seqs)
+        assert codes.shape[1] == len(self), "Sequence length does not match the structure ({:d}).".format(len(self))
+        temperature = np.broadcast_to(np.asarray(temperature, dtype=np.float32), (len(codes),))
+        uniq, inv = np.unique(temperature, return_inverse=True)
+        logp = self.log_prob(uniq, unused)
+        ll = logp[inv[:, None], np.arange(len(self))[None, :], np.maximum(codes, 0)]
+        ll = np.where(codes >= 0, ll, -np.inf)
+        return ll if per_residue else ll.sum(axis=1)
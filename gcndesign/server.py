@@ -0,0 +1,201 @@
+import json
+import time
+import queue
+import threading
+from os import path
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+import torch
+from .predictor import featurize, i2aa
+
+
+##  Request waiting for a micro-batch
+class _Job:
+    def __init__(self, entry):
+        self.entry = entry
+        self.logit = None
+        self.error = None
+        self.done = threading.Event()
+
+
+##  Prediction server
+class PredictionServer:
+    """
+    Long-running prediction server holding one Predictor.
+
+    Structures are featurized in the request threads, and the forward
+    passes of concurrent requests are collected into micro-batches of up
+    to 'batch_residues' residues (waiting at most 'max_wait' sec for more
+    requests) by a single batching thread.
+
+    Endpoints (JSON)
+    ----------------
+    POST /predict  {"pdb": file, "temperature": float}
+    POST /logits   {"pdb": file}
+    POST /resfile  {"pdb": file, "temperature": float, "prob_cut": float, "unused": [str, ...]}
+    GET  /stats    request, batch, latency & queue-depth counters & model settings
+    """
+
+    def __init__(self, predictor, host: str='127.0.0.1', port: int=8787,
+                 batch_residues: int=4000, max_wait: float=0.01):
+        self.predictor = predictor
+        self.batch_residues = batch_residues
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        # counters
+        self.started = time.time()
+        self.nrequest, self.nerror, self.nactive = 0, 0, 0
+        self.nbatch, self.nbatch_entry, self.nbatch_residue = 0, 0, 0
+        self.latency = deque(maxlen=1000)
+        # http server & batching thread
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.app = self
+        self.batcher = threading.Thread(target=self._batch_loop, daemon=True)
+        self.batcher.start()
+
+    def serve_forever(self):
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self.httpd.server_close()
+
+    def shutdown(self):
+        self.httpd.shutdown()
+
+    ##  micro-batching  ##
+    def _batch_loop(self):
+        while True:
+            jobs = [self.queue.get()]
+            nres = len(jobs[0].entry['node'])
+            deadline = time.time() + self.max_wait
+            while nres < self.batch_residues:
+                try:
+                    job = self.queue.get(timeout=max(0.0, deadline - time.time()))
+                except queue.Empty:
+                    break
+                jobs.append(job)
+                nres += len(job.entry['node'])
+            try:
+                for job, logit in zip(jobs, self.predictor._forward([job.entry for job in jobs])):
+                    job.logit = logit
+            except Exception as e:
+                for job in jobs:
+                    job.error = e
+            with self.lock:
+                self.nbatch += 1
+                self.nbatch_entry += len(jobs)
+                self.nbatch_residue += nres
+            for job in jobs:
+                job.done.set()
+
+    def logit(self, pdb: str):
+        assert path.isfile(pdb), "PDB file {:s} was not found.".format(pdb)
+        predictor = self.predictor
+        key = predictor.cache.key(pdb, predictor.param_hash, predictor.hypara) if predictor.cache is not None else None
+        with self.lock:
+            entry = predictor.cache.get(key) if key else None
+        if entry is None:
+            job = _Job(featurize(pdb, predictor.hypara))
+            self.queue.put(job)
+            job.done.wait()
+            if job.error is not None:
+                raise job.error
+            entry = job.entry
+            entry['logit'] = job.logit
+            if key:
+                with self.lock:
+                    predictor.cache.put(key, entry)
+        return torch.from_numpy(entry['logit']), list(entry['aa1']), list(entry['iaa2org'])
+
+    def stats(self):
+        with self.lock:
+            latency = np.array(self.latency) if self.latency else np.zeros(1)
+            return {'uptime': time.time() - self.started,
+                    'requests': self.nrequest, 'errors': self.nerror, 'active': self.nactive,
+                    'queue_depth': self.queue.qsize(),
+                    'batches': self.nbatch,
+                    'mean_batch_entries': self.nbatch_entry / max(self.nbatch, 1),
+                    'mean_batch_residues': self.nbatch_residue / max(self.nbatch, 1),
+                    'latency_mean': float(latency.mean()),
+                    'latency_p50': float(np.percentile(latency, 50)),
+                    'latency_p95': float(np.percentile(latency, 95)),
+                    'latency_max': float(latency.max()),
+                    'settings': self.settings()}
+
+    def settings(self):
+        # model options of the predictor (compared by the clients)
+        predictor = self.predictor
+        return {'param_in': path.abspath(predictor.param), 'quantize': predictor.quantize,
+                'precision': predictor.precision, 'device': predictor.device}
+
+    ##  endpoints  ##
+    def handle(self, route, query):
+        predictor = self.predictor
+        if route == '/stats':
+            return self.stats()
+        pdb = query.get('pdb')
+        assert pdb, "Key 'pdb' is required."
+        logit, aa1, iaa2org = self.logit(pdb)
+        temperature = float(query.get('temperature', 1.0))
+        if route == '/logits':
+            return {'logits': logit.numpy().tolist(), 'aa1': aa1, 'iaa2org': iaa2org, 'i2aa': list(i2aa)}
+        if route == '/predict':
+            summary = predictor._summary(logit, aa1, iaa2org, temperature)
+            return {'predict': [({k: float(v) for k, v in p.items()}, info) for p, info in summary]}
+        if route == '/resfile':
+            resfile = predictor._resfile(logit, aa1, iaa2org, temperature,
+                                         float(query.get('prob_cut', 0.8)), query.get('unused'))
+            return {'resfile': resfile}
+        raise KeyError(route)
+
+
+##  HTTP request handler
+class _Handler(BaseHTTPRequestHandler):
+    routes = ('/predict', '/logits', '/resfile', '/stats')
+
+    def _reply(self, code, body):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _dispatch(self, query):
+        app = self.server.app
+        route = self.path.split('?')[0]
+        if route not in self.routes:
+            return self._reply(404, {'error': 'Unknown endpoint {:s}.'.format(route)})
+        start = time.time()
+        with app.lock:
+            app.nrequest += 1
+            app.nactive += 1
+        try:
+            code, body = 200, app.handle(route, query)
+        except AssertionError as e:
+            code, body = 400, {'error': str(e)}
+        except Exception as e:
+            code, body = 500, {'error': '{:s}: {:s}'.format(type(e).__name__, str(e))}
+        with app.lock:
+            app.nactive -= 1
+            app.nerror += (code != 200)
+            if route != '/stats':
+                app.latency.append(time.time() - start)
+        self._reply(code, body)
+
+    def do_GET(self):
+        self._dispatch({})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            query = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self._reply(400, {'error': 'Request body is not JSON.'})
+        self._dispatch(query)
+
+    def log_message(self, format, *args):
+        return
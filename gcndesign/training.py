@@ -1,171 +1,206 @@
 import sys
 import torch
+import torch.distributed as dist
 import numpy as np
+from torch.utils.data import Sampler, DataLoader
+from .metrics import Metrics
+from .models import precision_autocast
 
 
-##  matrix connecter (MxM),(NxN) -> ((M+N)x(M+N))
-def mat_connect(mat1, mat2):
-    size1 = list(mat1.shape)
-    size2 = list(mat2.shape)
-    size1[2] = mat2.shape[2]
-    size2[2] = mat1.shape[2]
-    # blank region
-    blank1 = torch.zeros(size1, dtype=mat1.dtype)
-    blank2 = torch.zeros(size2, dtype=mat2.dtype)
-    # concat blank
-    mat1_extend = torch.cat((mat1, blank1), dim=2)
-    mat2_extend = torch.cat((blank2, mat2), dim=2)
-    # concat mat1 & mat2
-    mat = torch.cat((mat1_extend, mat2_extend), dim=1)
-    # return
-    return mat
+##  Rank & number of processes of distributed training (0 & 1 otherwise)
+def get_rank():
+    return dist.get_rank() if dist.is_available() and dist.is_initialized() else 0
+
+def get_world_size():
+    return dist.get_world_size() if dist.is_available() and dist.is_initialized() else 1
 
 
-##  Batch controller
-class BatchLoader:
-    def __init__(self, dataloader, maxsize):
-        self.loader = iter(dataloader)
-        self.store = next(self.loader)
-        self.maxsize = maxsize
-        self.counter = len(self.loader)-1
+##  Length-bucketed batches under a residue budget
+class LengthBucketSampler(Sampler):
+    """
+    Batch sampler grouping proteins of similar length into batches of at
+    most 'max_residues' residues (a longer protein makes its own batch).
+    With shuffle=True, proteins are shuffled within length buckets of
+    'bucket_width' residues before the split, so that the composition of
+    the batches changes every epoch (set_epoch), and the order of the
+    batches is shuffled.
+
+    In distributed training, the batches are split among the processes;
+    with pad=True every process gets the same number of batches (some
+    are repeated), as needed for gradient synchronization.
+    """
+    def __init__(self, lengths, max_residues, shuffle=True, seed=0, pad=True, num_replicas=None, rank=None,
+                 bucket_width: int=32):
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.max_residues = max_residues
+        self.bucket_width = bucket_width
+        self.shuffle = shuffle
+        self.seed = seed
+        self.pad = pad
+        self.num_replicas = get_world_size() if num_replicas is None else num_replicas
+        self.rank = get_rank() if rank is None else rank
+        self.epoch = 0
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+    def _batches(self):
+        # all batches of the epoch (same on every process)
+        rng = np.random.default_rng((self.seed, self.epoch))
+        if self.shuffle:
+            order = np.lexsort((rng.random(len(self.lengths)), self.lengths // self.bucket_width))
+        else:
+            order = np.lexsort((np.arange(len(self.lengths)), self.lengths))
+        # greedy split of the sorted list at the budget
+        batches, ini, total = [], 0, 0
+        for i, idx in enumerate(order):
+            if i > ini and total + self.lengths[idx] > self.max_residues:
+                batches.append(order[ini:i].tolist())
+                ini, total = i, 0
+            total += self.lengths[idx]
+        if ini < len(order):
+            batches.append(order[ini:].tolist())
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        return batches
+    def batches(self):
+        batches = self._batches()
+        # shard of this process (same batches on every process before splitting)
+        if self.num_replicas > 1:
+            if self.pad:
+                batches += [batches[i % len(batches)] for i in range(-len(batches) % self.num_replicas)]
+            batches = batches[self.rank::self.num_replicas]
+        return batches
+    def num_padded(self):
+        # number of repeated batches (at the end) of this process
+        if self.num_replicas <= 1 or not self.pad:
+            return 0
+        n = len(self._batches())
+        return sum(1 for i in range(n, n + (-n % self.num_replicas)) if i % self.num_replicas == self.rank)
     def __iter__(self):
-        return self
-    def __next__(self):
-        if self.counter < 0: raise StopIteration
-        num = 1
-        # get current data
-        dat1, dat2, dat3, target, mask, name = self.store
-        name = str(name)
-        total_size = self.store[0].shape[1]
-        if self.counter <= 0:
-            self.counter = -1
-            return dat1, dat2, dat3, target, mask, name, num
-        # store next data
-        self.store = next(self.loader)
-        self.counter -= 1
-        total_size = total_size + self.store[0].shape[1]
-        # iteratively stacking
-        while total_size < self.maxsize:
-            dat1 = torch.cat((dat1, self.store[0]), 1)
-            dat2 = mat_connect(dat2, self.store[1])
-            dat3 = mat_connect(dat3, self.store[2])
-            target = torch.cat((target, self.store[3]), 1)
-            mask = torch.cat((mask, self.store[4]), 1)
-            name = name + '_' + str(self.store[5])
-            num += 1
-            if self.counter <= 0:
-                self.counter = -1
-                return dat1, dat2, dat3, target, mask, name, num
-            self.store = next(self.loader)
-            self.counter -= 1
-            total_size = total_size + self.store[0].shape[1]
-        # return
-        return dat1, dat2, dat3, target, mask, name, num
+        return iter(self.batches())
+    def __len__(self):
+        return len(self.batches())
+
+
+##  Collate sparse samples into one graph (neighbor indices shifted)
+def collate_sparse(samples):
+    node, edge, nnidx, label, mask, name = zip(*samples)
+    assert not nnidx[0].dtype == torch.bool, "Batches are built only from sparse (neighbor-list) data."
+    segments = [len(n) for n in node]
+    offsets = np.cumsum([0] + segments[:-1]).tolist()
+    # one allocation per tensor
+    nnidx_batch = torch.empty((sum(segments), nnidx[0].shape[1]), dtype=torch.long)
+    for n, ini, length in zip(nnidx, offsets, segments):
+        torch.add(n, ini, out=nnidx_batch[ini:ini+length])
+    return torch.cat(node), torch.cat(edge), nnidx_batch, torch.cat(label), torch.cat(mask), list(name), segments
+
+
+##  DataLoader of length-bucketed batches (dataset with 'lengths')
+def batch_loader(dataset, max_residues, shuffle=True, seed=0, num_workers: int=0, prefetch: int=2, pin_memory: bool=False,
+                 pad: bool=True):
+    # batches are loaded & collated in 'num_workers' processes, 'prefetch' batches ahead per worker
+    sampler = LengthBucketSampler(dataset.lengths, max_residues, shuffle=shuffle, seed=seed, pad=pad)
+    options = {'prefetch_factor': prefetch, 'persistent_workers': True} if num_workers > 0 else {}
+    return DataLoader(dataset=dataset, batch_sampler=sampler, collate_fn=collate_sparse,
+                      num_workers=num_workers, pin_memory=pin_memory, **options)
 
 
 ##  Training module
-def train(model, criterion, source, train_loader, optimizer, hypara):
+def train(model, criterion, source, train_loader, optimizer, hypara, metrics: Metrics=None):
     model.train()
-    # for transfer learning
+    # for transfer learning (DistributedDataParallel must wrap the model after freezing)
     if source.onlypred is True:
-        for params in model.embedding.parameters():
+        net = getattr(model, 'module', model)
+        assert net is model or not any(p.requires_grad for p in net.embedding.parameters()), \
+            "The embedding must be frozen before wrapping by DistributedDataParallel."
+        for params in net.embedding.parameters():
             params.requires_grad = False
-    # training
-    batch_loader = BatchLoader(train_loader, hypara.batchsize_cut)
-    total_loss, total_count, total_correct, total_sample_count = 0, 0, 0, 0
-    for batch_idx, (dat1, dat2, dat3, target, mask, name, num) in enumerate(batch_loader):
-        dat1 = dat1.squeeze(0).to(source.device)
-        dat2 = dat2.squeeze(0).to(source.device)
-        dat3 = dat3.squeeze(0).to(source.device)
-        target = target.squeeze(0).to(source.device)
-        mask = mask.squeeze(0).to(source.device)
-        total_sample_count += num
+    # training (batches of LengthBucketSampler & collate_sparse)
+    metrics = Metrics() if metrics is None else metrics
+    total_sample_count = 0
+    # repeated batches of distributed training (at the end) are trained on but not counted
+    sampler = train_loader.batch_sampler
+    nbatch = len(train_loader) - (sampler.num_padded() if hasattr(sampler, 'num_padded') else 0)
+    nsample = sum(len(b) for b in sampler.batches()[:nbatch]) if hasattr(sampler, 'batches') else len(train_loader.dataset)
+    for batch_idx, (dat1, dat2, dat3, target, mask, name, segments) in enumerate(train_loader):
+        dat1 = dat1.to(source.device)
+        dat2 = dat2.to(source.device)
+        dat3 = dat3.to(source.device)
+        target = target.to(source.device)
+        mask = mask.to(source.device)
+        padded = batch_idx >= nbatch
+        total_sample_count += 0 if padded else len(segments)
         optimizer.zero_grad()
-        outputs = model(dat1, dat2, dat3)
+        with precision_autocast(source.device, getattr(source, 'precision', None)):
+            outputs = model(dat1, dat2, dat3, segments=segments)
         #loss = criterion(outputs*(mask.unsqueeze(1).float()), target)
         loss = criterion(outputs[mask], target[mask])
-        predicted = torch.max(outputs, 1)
-        count, correct = 0, 0
-        for iaa in range(target.size()[0]):
-            if (mask[iaa] == True):
-                count = count + 1
-                if (predicted[1][iaa] == target[iaa]):
-                    correct = correct + 1
-        total_count += count
-        total_correct += correct
-        total_loss += loss.item()*count
+        if not padded:
+            metrics.update(outputs.detach(), target, mask, segments)
         ##  backward  ##
         loss.backward()
         optimizer.step()
         ################
-        sys.stderr.write('\r\033[K' + '[{}/{}]'.format(total_sample_count, train_loader.__len__()))
-        sys.stderr.flush()
+        if get_rank() == 0:
+            sys.stderr.write('\r\033[K' + '[{}/{}]'.format(total_sample_count, nsample))
+            sys.stderr.flush()
     # loss & accuracy
-    avg_loss = total_loss / total_count
-    avg_acc = 100 * total_correct / total_count
-    print(' T.Loss: {loss:.3f},  T.Acc: {acc:.3f}, '.
-          format(loss=avg_loss, acc=avg_acc, file=sys.stderr), end='')
+    result = metrics.compute()
+    avg_loss, avg_acc = result['loss'], result['recovery']
+    if get_rank() == 0:
+        print(' T.Loss: {loss:.3f},  T.Acc: {acc:.3f}, '.
+              format(loss=avg_loss, acc=avg_acc, file=sys.stderr), end='')
     # return
     return avg_loss, avg_acc
 
 
 ##  Validation module
-def valid(model, criterion, source, valid_loader):
+def valid(model, criterion, source, valid_loader, metrics: Metrics=None):
     model.eval()
-    total_loss, total_count, total_correct = 0, 0, 0
+    metrics = Metrics() if metrics is None else metrics
     with torch.no_grad():
-        for batch_idx, (dat1, dat2, dat3, target, mask, name) in enumerate(valid_loader):
-            dat1 = dat1.squeeze(0).to(source.device)
-            dat2 = dat2.squeeze(0).to(source.device)
-            dat3 = dat3.squeeze(0).to(source.device)
-            target = target.squeeze(0).to(source.device)
-            mask = mask.squeeze(0).to(source.device)
-            outputs = model(dat1, dat2, dat3)
-            #loss = criterion(outputs*(mask.unsqueeze(1).float()), target)
-            loss = criterion(outputs[mask], target[mask])
-            predicted = torch.max(outputs, 1)
-            count, correct = 0, 0
-            for iaa in range(target.size()[0]):
-                if (mask[iaa] == True):
-                    count = count + 1
-                    if (predicted[1][iaa] == target[iaa]):
-                        correct = correct + 1
-            total_count += count
-            total_correct += correct
-            total_loss += loss.item()*count
+        for batch_idx, (dat1, dat2, dat3, target, mask, name, segments) in enumerate(valid_loader):
+            dat1 = dat1.to(source.device)
+            dat2 = dat2.to(source.device)
+            dat3 = dat3.to(source.device)
+            target = target.to(source.device)
+            mask = mask.to(source.device)
+            with precision_autocast(source.device, getattr(source, 'precision', None)):
+                outputs = model(dat1, dat2, dat3, segments=segments)
+            metrics.update(outputs, target, mask, segments)
     # loss & accuracy
-    avg_loss = total_loss/total_count
-    avg_acc = 100*total_correct/total_count
-    print(' V.Loss: {loss:.3f}, V.Acc: {acc:.3f}'.
-          format(loss=avg_loss, acc=avg_acc, file=sys.stderr))
+    result = metrics.compute()
+    avg_loss, avg_acc = result['loss'], result['recovery']
+    if get_rank() == 0:
+        print(' V.Loss: {loss:.3f}, V.Acc: {acc:.3f}'.
+              format(loss=avg_loss, acc=avg_acc, file=sys.stderr))
     # return
     return avg_loss, avg_acc
 
 
 ##  Test module
-def test(model, criterion, source, test_loader):
+def test(model, criterion, source, test_loader, metrics: Metrics=None):
     model.eval()
-    total_loss, total_count, total_correct = 0, 0, 0
+    metrics = Metrics() if metrics is None else metrics
     with torch.no_grad():
-        for batch_idx, (dat1, dat2, dat3, target, mask, name) in enumerate(test_loader):
-            dat1 = dat1.squeeze(0).to(source.device)
-            dat2 = dat2.squeeze(0).to(source.device)
-            dat3 = dat3.squeeze(0).to(source.device)
-            target = target.squeeze(0).to(source.device)
-            mask = mask.squeeze(0).to(source.device)
-            outputs = model(dat1, dat2, dat3)
-            #loss = criterion(outputs*(mask.unsqueeze(1).float()), target).item()
-            loss = criterion(outputs[mask], target[mask]).item()
-            predicted = torch.max(outputs, 1)
-            count, correct = 0, 0
-            for iaa in range(target.size()[0]):
-                if (mask[iaa] == True):
-                    count = count + 1
-                    if (predicted[1][iaa] == target[iaa]):
-                        correct = correct + 1
-            print('Loss=%7.4f   Acc=%6.2f %%  : L=%4d (%s)' % (loss, 100*correct/count, count, name[0]))
-            total_count += count
-            total_loss += loss*count
-            total_correct += correct
+        for batch_idx, (dat1, dat2, dat3, target, mask, name, segments) in enumerate(test_loader):
+            dat1 = dat1.to(source.device)
+            dat2 = dat2.to(source.device)
+            dat3 = dat3.to(source.device)
+            target = target.to(source.device)
+            mask = mask.to(source.device)
+            with precision_autocast(source.device, getattr(source, 'precision', None)):
+                outputs = model(dat1, dat2, dat3, segments=segments)
+            # per protein
+            seg_loss, seg_count, seg_correct = metrics.update(outputs, target, mask, segments)
+            for loss, count, correct, nm in zip(seg_loss.tolist(), seg_count.tolist(), seg_correct.tolist(), name):
+                print('Loss=%7.4f   Acc=%6.2f %%  : L=%4d (%s)' % (loss/count, 100*correct/count, count, nm))
+    # summary
+    result = metrics.compute()
+    for k, acc in result['topk'].items():
+        print('Top-%d Acc=%6.2f %%' % (k, acc))
+    for lower, upper, nprotein, count, loss, acc in result['bins']:
+        if nprotein == 0: continue
+        print('Loss=%7.4f   Acc=%6.2f %%  : L=%4d-%-4s (%d proteins, %d residues)'
+              % (loss, acc, lower, upper if upper else '', nprotein, count))
     # return
-    return total_loss/total_count, 100*total_correct/total_count
+    return result['loss'], result['recovery']
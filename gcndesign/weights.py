@@ -0,0 +1,58 @@
+import pickle
+import dataclasses
+import torch
+from .hypara import HyperParam
+from .models import GCNdesign
+
+##  Versioned parameter file
+#  {'format': 'gcndesign-params', 'version': 1,
+#   'hypara': dict of HyperParam, 'state_dict': state dict of GCNdesign}
+#  saved by torch.save, loadable with weights_only=True & mmap=True
+params_format = 'gcndesign-params'
+params_version = 1
+
+
+def params_dict(model, state_dict=None):
+    # contents of the versioned parameter file (tensors on cpu)
+    if state_dict is None:
+        state_dict = {k: v.detach().cpu() for k, v in model.state_dict().items()}
+    return {'format': params_format,
+            'version': params_version,
+            'hypara': dataclasses.asdict(model.hypara),
+            'state_dict': state_dict}
+
+
+def save_params(model, file):
+    torch.save(params_dict(model), file)
+
+
+def read_params(file):
+    # None for files other than the versioned format (e.g. pickled nn.Module)
+    try:
+        params = torch.load(file, map_location='cpu', mmap=True, weights_only=True)
+    except (pickle.UnpicklingError, RuntimeError):
+        return None
+    if not (isinstance(params, dict) and params.get('format') == params_format):
+        return None
+    assert params['version'] <= params_version, \
+        "Parameter file {:s} has unsupported version {:d}.".format(file, params['version'])
+    return params
+
+
+def load_model(file, device='cpu'):
+    """
+    Returns (model, hypara) from a versioned parameter file, in which the
+    tensors are memory-mapped (shared between forked processes on cpu), or
+    (model, None) from a pickled whole model (legacy format).
+    """
+    params = read_params(file)
+    if params is None:
+        model = torch.load(file, map_location=torch.device(device), weights_only=False)
+        return model, None
+    fields = {f.name for f in dataclasses.fields(HyperParam)}
+    hypara = HyperParam(**{k: v for k, v in params['hypara'].items() if k in fields})
+    # built without initialization & assigned the (memory-mapped) tensors
+    with torch.device('meta'):
+        model = GCNdesign(hypara)
+    model.load_state_dict(params['state_dict'], assign=True)
+    return model.to(device), hypara
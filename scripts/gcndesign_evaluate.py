@@ -0,0 +1,96 @@
+#! /usr/bin/env python
+
+import sys
+import io
+import time
+from os import path
+import argparse
+import numpy as np
+import torch
+
+dir_script = path.dirname(path.realpath(__file__))
+sys.path.append(dir_script+'/../')
+from gcndesign.hypara import HyperParam, InputSource
+from gcndesign.predictor import Predictor, featurize, i2aa
+
+# argument parser
+parser = argparse.ArgumentParser()
+parser.add_argument('--list-in', '-l', required=True, type=str, default=None, metavar='[File]',
+                    help='List of held-out PDB structures.')
+parser.add_argument('--param-in', '-p', type=str, default=InputSource().param_in, metavar='[File]',
+                    help='NN parameter file. (default:{})'.format(InputSource().param_in))
+parser.add_argument('--quantize', '-q', type=str, default='int8', choices=['int8', 'none'],
+                    help='Quantization mode compared with the float model. (default:{})'.format('int8'))
+parser.add_argument('--precision', type=str, default=None, choices=['bf16'],
+                    help='Reduced precision (autocast) compared with the float model. (default:{})'.format(None))
+parser.add_argument('--output', '-o', type=str, default=None, metavar='[File]',
+                    help='Per-structure results (tsv). (default:{})'.format(None))
+args = parser.parse_args()
+
+# check files
+assert path.isfile(args.list_in), "Input file {:s} is not found.".format(args.list_in)
+assert path.isfile(args.param_in), "Parameter file {:s} was not found.".format(args.param_in)
+
+# held-out structures
+with open(args.list_in, 'r') as f:
+    pdbs = [l.split()[0] for l in f.read().splitlines() if l.strip()]
+hypara = HyperParam()
+entries = [featurize(pdb, hypara) for pdb in pdbs]
+
+# models
+modes = {'float': {}}
+if args.quantize != 'none':
+    modes[args.quantize] = {'quantize': args.quantize}
+if args.precision:
+    modes[args.precision] = {'precision': args.precision}
+assert len(modes) > 1, "No mode to be compared with the float model."
+others = [mode for mode in modes if mode != 'float']
+results = {}
+for mode, kwargs in modes.items():
+    predictor = Predictor(device='cpu', param=args.param_in, hypara=hypara, **kwargs)
+    buf = io.BytesIO()
+    torch.save(predictor.model.state_dict(), buf)
+    predictor._forward(entries[:1])
+    start = time.time()
+    logits = [predictor._forward([e])[0] for e in entries]
+    elapsed = time.time() - start
+    results[mode] = {'logits': logits, 'time': elapsed, 'size': buf.tell()}
+
+# sequence recovery
+def recovery(logit, aa1):
+    pred = np.array(i2aa)[logit.argmax(axis=1)]
+    valid = np.isin(aa1, i2aa)
+    return (pred == aa1)[valid].sum(), valid.sum()
+
+nres = sum(len(e['aa1']) for e in entries)
+lines = ['#pdb\tlength\trecovery_float' + ''.join('\trecovery_{:s}\tagreement_{:s}'.format(m, m) for m in others)]
+total = {mode: [0, 0] for mode in modes}
+agree = {mode: 0 for mode in others}
+for i, (pdb, e) in enumerate(zip(pdbs, entries)):
+    lf = results['float']['logits'][i]
+    cols = []
+    for mode in modes:
+        logit = results[mode]['logits'][i]
+        ncorrect, nvalid = recovery(logit, e['aa1'])
+        total[mode][0] += ncorrect
+        total[mode][1] += nvalid
+        cols.append(ncorrect / max(nvalid, 1))
+        if mode != 'float':
+            nagree = (lf.argmax(axis=1) == logit.argmax(axis=1)).sum()
+            agree[mode] += nagree
+            cols.append(nagree / len(lf))
+    lines.append('{:s}\t{:d}\t'.format(pdb, len(lf)) + '\t'.join('{:.4f}'.format(v) for v in cols))
+if args.output:
+    with open(args.output, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+# report
+print('# {:d} structures, {:d} residues'.format(len(pdbs), nres))
+for mode in modes:
+    rec = total[mode][0] / max(total[mode][1], 1)
+    print('{:8s} recovery={:.4f} time={:.3f}s ({:.1f} res/s) size={:.1f}MB'.format(
+        mode, rec, results[mode]['time'], nres / results[mode]['time'], results[mode]['size'] / 2**20))
+for mode in others:
+    delta = total[mode][0] / max(total[mode][1], 1) - total['float'][0] / max(total['float'][1], 1)
+    print('{:8s} delta recovery={:+.4f} argmax agreement={:.4f} speedup={:.2f}x'.format(
+        mode, delta, agree[mode] / nres, results['float']['time'] / results[mode]['time']))
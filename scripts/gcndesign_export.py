@@ -0,0 +1,52 @@
+#! /usr/bin/env python
+
+import sys
+from os import path
+import argparse
+import time
+
+dir_script = path.dirname(path.realpath(__file__))
+sys.path.append(dir_script+'/../')
+from gcndesign.hypara import HyperParam, InputSource
+from gcndesign.export import export_model
+from gcndesign.weights import load_model, save_params
+from gcndesign.predictor import Predictor, featurize
+
+# argument parser
+parser = argparse.ArgumentParser()
+parser.add_argument('--param-in', '-p', type=str, default=InputSource().param_in, metavar='[File]',
+                    help='NN parameter file. (default:{})'.format(InputSource().param_in))
+parser.add_argument('--output', '-o', type=str, default='param_export.pt', metavar='[File]',
+                    help='Exported TorchScript model. (default:{})'.format('param_export.pt'))
+parser.add_argument('--format', '-f', type=str, default='torchscript', choices=['torchscript', 'params'],
+                    help='"torchscript": folded & traced model, "params": versioned parameter file (state dict & hyperparameters). (default:{})'.format('torchscript'))
+parser.add_argument('--no-fold', action='store_true',
+                    help='Trace without folding BatchNorm layers.')
+parser.add_argument('--check-pdb', type=str, default=None, metavar='[File]',
+                    help='PDB file to compare logits & timing of the original & exported models. (default:{})'.format(None))
+args = parser.parse_args()
+
+# check files
+assert path.isfile(args.param_in), "Parameter file {:s} was not found.".format(args.param_in)
+
+# export
+model, hypara = load_model(args.param_in, 'cpu')
+hypara = hypara if hypara else HyperParam()
+if args.format == 'params':
+    save_params(model, args.output)
+else:
+    export_model(model, args.output, nneighbor=hypara.nneighbor, fold=not args.no_fold)
+print("Exported: {:s}".format(args.output))
+
+# check
+if args.check_pdb:
+    assert path.isfile(args.check_pdb), "PDB file {:s} was not found.".format(args.check_pdb)
+    for name, param in (('original', args.param_in), ('exported', args.output)):
+        predictor = Predictor(device='cpu', param=param)
+        entry = featurize(args.check_pdb, hypara)
+        predictor._forward([entry])
+        start = time.time()
+        logit = predictor._forward([entry])[0]
+        elapsed = time.time() - start
+        if name == 'original': logit0 = logit
+        print("{:s}: {:.3f} sec, max|dlogit|={:.2e}".format(name, elapsed, abs(logit - logit0).max()))
@@ -13,12 +13,26 @@ parser.add_argument('--list-in', '-l', required=True, type=str, default=None, me
                     help='List of PDB structures.')
 parser.add_argument('--dir-out', '-o', type=str, default='./', metavar='[Directory]',
                     help='Directory in which data processed will be stored.')
+parser.add_argument('--format', '-f', type=str, default='csv', choices=['csv', 'shard'],
+                    help='Output format; "shard" writes memory-mappable binary shards and shard_list.txt. (default:{})'.format('csv'))
+parser.add_argument('--shard-size', type=int, default=1000, metavar='[Int]',
+                    help='Number of structures per shard. (default:{})'.format(1000))
+parser.add_argument('--nworkers', '-j', type=int, default=1, metavar='[Int]',
+                    help='Number of worker processes. (default:{})'.format(1))
+parser.add_argument('--chunksize', type=int, default=8, metavar='[Int]',
+                    help='Number of structures sent to a worker at once. (default:{})'.format(8))
+parser.add_argument('--resume', action='store_true',
+                    help='Skip entries recorded in DIR_OUT/manifest.tsv and existing outputs.')
+parser.add_argument('--retry-failed', action='store_true',
+                    help='With --resume, process the entries recorded as failed again.')
 args = parser.parse_args()
 
 # check
 assert path.isfile(args.list_in), "Input file {:s} is not found.".format(args.list_in)
 
 # preprocessing
-Preprocessing(args.list_in, args.dir_out)
+Preprocessing(args.list_in, args.dir_out, format=args.format, shard_size=args.shard_size,
+              nworkers=args.nworkers, chunksize=args.chunksize, resume=args.resume,
+              retry_failed=args.retry_failed)
 
 
@@ -3,14 +3,10 @@
 import sys
 from os import path
 import argparse
-import torch
 
 dir_script = path.dirname(path.realpath(__file__))
 sys.path.append(dir_script+'/../')
-from gcndesign.predictor import Predictor
-
-# default processing device
-device = "cuda" if torch.cuda.is_available() else "cpu"
+from gcndesign.client import PredictionClient, default_address
 
 # argument parser
 parser = argparse.ArgumentParser()
@@ -20,7 +16,21 @@ parser.add_argument('--temperature', '-t', type=float, default=1.0, metavar='[Fl
                     help='Temperature: probability P(AA) is proportional to exp(logit(AA)/T). (default:{})'.format(1.0))
 parser.add_argument('--param-in', '-p', type=str, default=None, metavar='[File]',
                     help='NN parameter file. (default:{})'.format(None))
-parser.add_argument('--device', type=str, default=device, choices=['cpu', 'cuda'],
+parser.add_argument('--quantize', type=str, default=None, choices=['int8'],
+                    help='Quantized inference on cpu. (default:{})'.format(None))
+parser.add_argument('--precision', type=str, default=None, choices=['fp32', 'bf16'],
+                    help='Precision of the GCN blocks (autocast). (default:{})'.format('fp32'))
+parser.add_argument('--partition-size', type=int, default=None, metavar='[Int]',
+                    help='Split structures larger than this number of residues into spatial partitions. (default:{})'.format(None))
+parser.add_argument('--partition-workers', type=int, default=1, metavar='[Int]',
+                    help='Number of worker processes for the partitions. (default:{})'.format(1))
+parser.add_argument('--ensemble', type=str, default=None, metavar='[File]', nargs='+',
+                    help='NN parameter files of the ensemble members; mean(standard deviation) of the probabilities is printed. (default:{})'.format(None))
+parser.add_argument('--mc-samples', type=int, default=1, metavar='[Int]',
+                    help='Number of MC-dropout samples per model; mean(standard deviation) of the probabilities is printed. (default:{})'.format(1))
+parser.add_argument('--server', type=str, nargs='?', const=default_address, default=None, metavar='[Host:Port]',
+                    help='Use the prediction server if it is running (with the model options of the server). (default:{}, {} without value)'.format(None, default_address))
+parser.add_argument('--device', type=str, default=None, choices=['cpu', 'cuda'],
                     help='Processing device. (default:\'cuda\' if available)')
 args = parser.parse_args()
 
@@ -28,7 +38,34 @@ args = parser.parse_args()
 assert path.isfile(args.pdb), "PDB file {:s} was not found.".format(args.pdb)
     
 # prediction
-predictor = Predictor(device=args.device, param=args.param_in)
+client = PredictionClient(args.server) if args.server and not (args.ensemble or args.mc_samples > 1) else None
+if client and client.alive():
+    predictor = client
+    # the model options of the server apply (given options differing from them are ignored)
+    options = {opt: getattr(args, opt) for opt in ('param_in', 'quantize', 'precision', 'partition_size', 'partition_workers', 'device')
+               if getattr(args, opt) != parser.get_default(opt)}
+    if options.get('param_in'): options['param_in'] = path.abspath(options['param_in'])
+    ignored = client.ignored_options(options) if options else []
+    if ignored:
+        sys.stderr.write('Ignored with the prediction server at {:s} (its own settings apply): {:s}\n'
+                         .format(args.server, ', '.join('--'+opt.replace('_', '-') for opt in ignored)))
+else:
+    from gcndesign.predictor import Predictor
+    predictor = Predictor(device=args.device, param=args.param_in, quantize=args.quantize,
+                          partition_size=args.partition_size, partition_workers=args.partition_workers, precision=args.precision,
+                          ensemble=args.ensemble)
+
+# ensemble / MC-dropout
+if args.ensemble or args.mc_samples > 1:
+    pred = predictor.predict_ensemble(pdb=args.pdb, mc_samples=args.mc_samples, temperature=args.temperature)
+    for pdict, vdict, info in pred:
+        max_key = max(pdict, key=pdict.get)
+        print(' %4d %s %s:pred ' % (info['resnum'], info['original'], max_key), end='')
+        for aa in pdict.keys():
+            print(' %5.3f(%5.3f):%s' % (pdict[aa], vdict[aa]**0.5, aa), end='')
+        print('')
+    sys.exit()
+
 pred = predictor.predict(pdb=args.pdb, temperature=args.temperature)
 
 # output
@@ -3,23 +3,29 @@
 import sys
 from os import path
 import argparse
-import torch
 
 dir_script = path.dirname(path.realpath(__file__))
 sys.path.append(dir_script+'/../')
-from gcndesign.predictor import Predictor
+from gcndesign.client import PredictionClient, default_address
 from gcndesign.resfile import fix_native_resfile, expand_nums
 
-# default processing device
-device = "cuda" if torch.cuda.is_available() else "cpu"
-
 # argument parser
 parser = argparse.ArgumentParser()
 parser.add_argument('pdb', type=str, default=None, metavar='[File]',
                     help='PDB file input.')
 parser.add_argument('--prob-cut', '-c', type=float, default=0.6, metavar='[Float]',
                     help='Probability cutoff. (default:{})'.format(0.6))
-parser.add_argument('--device', type=str, default=device, choices=['cpu', 'cuda'],
+parser.add_argument('--quantize', type=str, default=None, choices=['int8'],
+                    help='Quantized inference on cpu. (default:{})'.format(None))
+parser.add_argument('--precision', type=str, default=None, choices=['fp32', 'bf16'],
+                    help='Precision of the GCN blocks (autocast). (default:{})'.format('fp32'))
+parser.add_argument('--partition-size', type=int, default=None, metavar='[Int]',
+                    help='Split structures larger than this number of residues into spatial partitions. (default:{})'.format(None))
+parser.add_argument('--partition-workers', type=int, default=1, metavar='[Int]',
+                    help='Number of worker processes for the partitions. (default:{})'.format(1))
+parser.add_argument('--server', type=str, nargs='?', const=default_address, default=None, metavar='[Host:Port]',
+                    help='Use the prediction server if it is running (with the model options of the server). (default:{}, {} without value)'.format(None, default_address))
+parser.add_argument('--device', type=str, default=None, choices=['cpu', 'cuda'],
                     help='Processing device. (default:\'cuda\' if available)')
 parser.add_argument('--keep', '-k', type=str, default=[], metavar='Str', nargs='+',
                     help='Residue numbers & chain id for keeping the initial amino-acid type. '
@@ -39,7 +45,21 @@ args = parser.parse_args()
 assert path.isfile(args.pdb), "PDB file {:s} was not found.".format(args.pdb)
     
 # predictor
-predictor = Predictor(device=args.device, param=args.param_in)
+client = PredictionClient(args.server) if args.server else None
+if client and client.alive():
+    predictor = client
+    # the model options of the server apply (given options differing from them are ignored)
+    options = {opt: getattr(args, opt) for opt in ('param_in', 'quantize', 'precision', 'partition_size', 'partition_workers', 'device')
+               if getattr(args, opt) != parser.get_default(opt)}
+    if options.get('param_in'): options['param_in'] = path.abspath(options['param_in'])
+    ignored = client.ignored_options(options) if options else []
+    if ignored:
+        sys.stderr.write('Ignored with the prediction server at {:s} (its own settings apply): {:s}\n'
+                         .format(args.server, ', '.join('--'+opt.replace('_', '-') for opt in ignored)))
+else:
+    from gcndesign.predictor import Predictor
+    predictor = Predictor(device=args.device, param=args.param_in, quantize=args.quantize,
+                          partition_size=args.partition_size, partition_workers=args.partition_workers, precision=args.precision)
 resfile = predictor.make_resfile(pdb=args.pdb, prob_cut=args.prob_cut, unused=args.unused)
 resfile = fix_native_resfile(resfile, resnums=expand_nums(args.keep), keeptype=args.keep_type)
 
@@ -0,0 +1,73 @@
+#! /usr/bin/env python
+
+import sys
+from os import path
+import argparse
+import numpy as np
+
+dir_script = path.dirname(path.realpath(__file__))
+sys.path.append(dir_script+'/../')
+from gcndesign.predictor import Predictor
+from gcndesign.resfile import expand_nums
+from gcndesign.sampler import decode
+
+# argument parser
+parser = argparse.ArgumentParser()
+parser.add_argument('pdb', type=str, default=None, metavar='[File]',
+                    help='PDB file input.')
+parser.add_argument('--nseq', '-n', type=int, default=100, metavar='[Int]',
+                    help='Number of sequences to be sampled. (default:{})'.format(100))
+parser.add_argument('--temperature', '-t', type=float, default=[1.0], metavar='[Float]', nargs='+',
+                    help='Temperature(s): nseq sequences are sampled at each temperature. (default:{})'.format(1.0))
+parser.add_argument('--keep', '-k', type=str, default=[], metavar='Str', nargs='+',
+                    help='Residue numbers & chain id for keeping the initial amino-acid type. '
+                         '(e.g. "-k 1A 2A 3B 11C-15C @D ...", @ represents all residues in the chain). '
+                         'Note that "-k 1 3-5 @" is interpreted as "-k 1A 3A-5A @A".')
+parser.add_argument('--unused', '-u', type=str, default=None, metavar='Char', nargs='+',
+                    help='Residue types not to be used. (e.g. "-e C H W ...")')
+parser.add_argument('--score', '-s', type=str, default=None, metavar='[File]',
+                    help='Score the sequences in the FASTA file instead of sampling. (default:{})'.format(None))
+parser.add_argument('--seed', type=int, default=None, metavar='[Int]',
+                    help='Random seed. (default:{})'.format(None))
+parser.add_argument('--param-in', '-p', type=str, default=None, metavar='[File]',
+                    help='NN parameter file. (default:{})'.format(None))
+parser.add_argument('--device', type=str, default=None, choices=['cpu', 'cuda'],
+                    help='Processing device. (default:\'cuda\' if available)')
+args = parser.parse_args()
+
+# check files
+assert path.isfile(args.pdb), "PDB file {:s} was not found.".format(args.pdb)
+
+# logits (computed once)
+predictor = Predictor(device=args.device, param=args.param_in)
+sampler = predictor.sampler(args.pdb)
+
+# scoring
+if args.score:
+    assert path.isfile(args.score), "FASTA file {:s} was not found.".format(args.score)
+    names, seqs = [], []
+    with open(args.score, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if line.startswith('>'):
+                names.append(line[1:].split()[0])
+                seqs.append('')
+            elif line:
+                seqs[-1] += line
+    for temperature in args.temperature:
+        score = sampler.score(seqs, temperature=temperature, unused=args.unused)
+        for name, s in zip(names, score):
+            print('{:s}\t{:.2f}\t{:.4f}'.format(name, temperature, s / len(sampler)))
+    sys.exit()
+
+# sampling
+temperature = np.repeat(args.temperature, args.nseq)
+keep = sampler.positions(expand_nums(args.keep)) if args.keep else None
+codes = sampler.sample(len(temperature), temperature=temperature, unused=args.unused, keep=keep, seed=args.seed)
+score = sampler.score(codes, temperature=temperature, unused=args.unused)
+
+# output (FASTA; temperature & mean log-likelihood per residue in the header)
+name = path.splitext(path.basename(args.pdb))[0]
+for i, (seq, t, s) in enumerate(zip(decode(codes), temperature, score)):
+    print('>{:s}_{:d} T={:.2f} score={:.4f}'.format(name, i, t, s / len(sampler)))
+    print(seq)
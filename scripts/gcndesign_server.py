@@ -0,0 +1,46 @@
+#! /usr/bin/env python
+
+import sys
+from os import path
+import argparse
+
+dir_script = path.dirname(path.realpath(__file__))
+sys.path.append(dir_script+'/../')
+from gcndesign.predictor import Predictor
+from gcndesign.cache import PredictionCache
+from gcndesign.server import PredictionServer
+
+# argument parser
+parser = argparse.ArgumentParser()
+parser.add_argument('--host', type=str, default='127.0.0.1', metavar='[Str]',
+                    help='Host address. (default:{})'.format('127.0.0.1'))
+parser.add_argument('--port', type=int, default=8787, metavar='[Int]',
+                    help='Port number. (default:{})'.format(8787))
+parser.add_argument('--param-in', '-p', type=str, default=None, metavar='[File]',
+                    help='NN parameter file. (default:{})'.format(None))
+parser.add_argument('--device', type=str, default=None, choices=['cpu', 'cuda'],
+                    help='Processing device. (default:\'cuda\' if available)')
+parser.add_argument('--quantize', type=str, default=None, choices=['int8'],
+                    help='Quantized inference on cpu. (default:{})'.format(None))
+parser.add_argument('--batch-residues', type=int, default=4000, metavar='[Int]',
+                    help='Maximum number of residues in a micro-batch. (default:{})'.format(4000))
+parser.add_argument('--max-wait', type=float, default=0.01, metavar='[Float]',
+                    help='Maximum time (sec) to wait for requests to fill a micro-batch. (default:{})'.format(0.01))
+parser.add_argument('--cache-size', type=int, default=256, metavar='[Int]',
+                    help='Number of structures kept in the prediction cache (0: no cache). (default:{})'.format(256))
+parser.add_argument('--dir-cache', type=str, default=None, metavar='[Directory]',
+                    help='Directory of the on-disk prediction cache. (default:{})'.format(None))
+args = parser.parse_args()
+
+# predictor
+cache = PredictionCache(maxsize=args.cache_size, dir_cache=args.dir_cache) if args.cache_size > 0 else None
+predictor = Predictor(device=args.device, param=args.param_in, quantize=args.quantize, cache=cache)
+
+# server
+server = PredictionServer(predictor, host=args.host, port=args.port,
+                          batch_residues=args.batch_residues, max_wait=args.max_wait)
+sys.stderr.write('Serving on http://{:s}:{:d}\n'.format(args.host, args.port))
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    pass
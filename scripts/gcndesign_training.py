@@ -1,18 +1,21 @@
 #! /usr/bin/env python
 
+import os
 import sys
 from os import path
 import argparse
 import torch
 import torch.nn as nn
-from torch.utils.data import DataLoader
+import torch.distributed as dist
 
 dir_script = path.dirname(path.realpath(__file__))
 sys.path.append(dir_script+'/../')
 from gcndesign.hypara import HyperParam, InputSource
-from gcndesign.dataset import BBGDataset, BBGDataset_fast
-from gcndesign.training import train, valid
+from gcndesign.dataset import BBGDataset, BBGDataset_shared, BBGDataset_shard
+from gcndesign.training import train, valid, batch_loader, get_rank
 from gcndesign.models import GCNdesign, weights_init
+from gcndesign.weights import load_model
+from gcndesign.checkpoint import CheckpointWriter
 
 hypara = HyperParam()
 source = InputSource()
@@ -28,6 +31,8 @@ parser.add_argument('--valid_list', '-v', type=str, metavar='[File, File, ...]',
                     help='List of validation data.', required=True)
 parser.add_argument('--epochs', '-e', type=int, default=hypara.nepoch, metavar='[Int]',
                     help='Number of training epochs. (default:{})'.format(hypara.nepoch))
+parser.add_argument('--batch-residues', type=int, default=hypara.batchsize_cut, metavar='[Int]',
+                    help='Maximum number of residues in a batch (per process in distributed training). (default:{})'.format(hypara.batchsize_cut))
 parser.add_argument('--learning-rate', '-lr', type=float, default=hypara.learning_rate, metavar='[Float]',
                     help='Learning rate. (default:{})'.format(hypara.learning_rate))
 parser.add_argument('--only-predmodule', action='store_true',
@@ -38,12 +43,31 @@ parser.add_argument('--param-in', type=str, default=source.param_in, metavar='[F
                     help='Pre-trained parameter file. (default:{})'.format(source.param_in))
 parser.add_argument('--checkpoint-in', type=str, default=None, metavar='[File]',
                     help='Checkpoint file. (default:{})'.format(None))
+parser.add_argument('--keep-last', type=int, default=None, metavar='[Int]',
+                    help='Number of the latest epochs whose parameter & checkpoint files are kept. (default:all)')
+parser.add_argument('--keep-best', action='store_true',
+                    help='Also keep the files of the epoch with the lowest validation loss.')
+parser.add_argument('--keep-every', type=int, default=None, metavar='[Int]',
+                    help='Also keep the files of every k-th epoch. (default:{})'.format(None))
 parser.add_argument('--output', '-o', type=str, default=source.file_out, metavar='[File]',
                     help='Output file. (default:"'+source.file_out+'")')
 parser.add_argument('--device', type=str, default=source.device, choices=['cpu', 'cuda'],
                     help='Processing device (default:\'cuda\' if available).')
-parser.add_argument('--dataloader', type=str, default='slow-HDD', choices=['slow-HDD', 'fast-RAM'],
-                    help='DataLoader type.(default:{})'.format('slow-HDD'))
+parser.add_argument('--dataloader', type=str, default='slow-HDD', choices=['slow-HDD', 'fast-RAM', 'shard'],
+                    help='DataLoader type. "fast-RAM" decodes the data once into shared memory. '
+                         'For "shard", the lists are lists of shard index files (.idx). (default:{})'.format('slow-HDD'))
+parser.add_argument('--num-workers', '-j', type=int, default=0, metavar='[Int]',
+                    help='Number of DataLoader worker processes (also used for decoding in "fast-RAM"). (default:{})'.format(0))
+parser.add_argument('--prefetch', type=int, default=2, metavar='[Int]',
+                    help='Number of batches loaded ahead per worker. (default:{})'.format(2))
+parser.add_argument('--cache-dir', type=str, default=None, metavar='[Directory]',
+                    help='Directory of the decoded data for "fast-RAM". (default:/dev/shm)')
+parser.add_argument('--checkpoint-activations', action='store_true',
+                    help='Recompute activations of the GCN blocks in backward instead of storing them (less memory, slower).')
+parser.add_argument('--precision', type=str, default=source.precision, choices=['fp32', 'bf16'],
+                    help='Precision of the GCN blocks (autocast); the 1D modules & the loss stay float32. (default:{})'.format(source.precision))
+parser.add_argument('--seed', type=int, default=None, metavar='[Int]',
+                    help='Random seed of the weight initialization & dropout. (default:{})'.format(None))
 
 parser.add_argument('--dim-hidden-node0', '-dn0', type=int, default=hypara.d_embed_h_node0, metavar='[Int]',
                     help='Hidden dimentions of the first note-embedding layers. (default:{})'.format(hypara.d_embed_h_node0))
@@ -78,12 +102,26 @@ parser.add_argument('--fragsize', '-f', type=int, default=hypara.fragment_size,
 args = parser.parse_args()
 hypara.nepoch = args.epochs
 hypara.learning_rate = args.learning_rate
+hypara.batchsize_cut = args.batch_residues
 source.file_train = args.train_list
 source.file_valid = args.valid_list
 source.onlypred = args.only_predmodule
 source.param_prefix = args.param_prefix
+source.param_in = args.param_in
 source.file_out = args.output
 source.device = args.device
+source.precision = args.precision
+
+# distributed data-parallel training (launched by torchrun, e.g. "torchrun --nproc-per-node 4 gcndesign_training.py ...")
+distributed = int(os.environ.get('WORLD_SIZE', 1)) > 1
+if distributed:
+    dist.init_process_group(backend='nccl' if source.device == 'cuda' else 'gloo')
+    if source.device == 'cuda':
+        source.device = 'cuda:{:d}'.format(int(os.environ['LOCAL_RANK']))
+        torch.cuda.set_device(source.device)
+main_process = get_rank() == 0
+if args.seed is not None:
+    torch.manual_seed(args.seed + get_rank())
 hypara.d_embed_h_node0 = args.dim_hidden_node0
 hypara.nlayer_embed_node0 = args.layer_embed_node0
 hypara.niter_embed_rgc = args.iter_gcn
@@ -102,9 +140,13 @@ hypara.fragment_size = args.fragsize
 assert path.isfile(source.file_train), "Training data file {:s} was not found.".format(source.file_train)
 assert path.isfile(source.file_valid), "Validation data file {:s} was not found.".format(source.file_valid)
 
+# parameter & checkpoint files (the output directory is checked here)
+writer = CheckpointWriter(source.param_prefix, keep_last=args.keep_last, keep_best=args.keep_best,
+                          keep_every=args.keep_every) if main_process else None
+
 # if checkpoint
 if args.checkpoint_in != None:
-    checkpoint = torch.load(args.checkpoint_in)
+    checkpoint = torch.load(args.checkpoint_in, map_location='cpu', weights_only=False)
     hypara = checkpoint['hyperparams']
     model = GCNdesign(hypara)
     params = model.size()
@@ -130,40 +172,61 @@ else:
 # for transfer learning
 if source.onlypred is True:
     assert path.isfile(source.param_in), "Parameter file {:s} was not found.".format(source.param_in)
-    model = torch.load(source.param_in, map_location=torch.device(source.device))
+    model, _ = load_model(source.param_in, source.device)
     model.prediction.apply(weights_init)
+    # embedding frozen before wrapping by DistributedDataParallel (gradients of all trainable parameters are expected)
+    for p in model.embedding.parameters():
+        p.requires_grad = False
+    optimizer = torch.optim.Adam([p for p in model.parameters() if p.requires_grad], lr=hypara.learning_rate)
+    scheduler = torch.optim.lr_scheduler.StepLR(optimizer, step_size=hypara.nepoch-10, gamma=0.1)
+
+# activation checkpointing
+model.embedding.checkpoint = args.checkpoint_activations
+
+# gradients are all-reduced among the processes (parameters are broadcast from rank 0)
+net = model
+if distributed:
+    model = nn.parallel.DistributedDataParallel(net)
 
 # dataloader setup
-train_dataset = BBGDataset(listfile=source.file_train, hypara=hypara) if args.dataloader == 'slow-HDD' else BBGDataset_fast(listfile=source.file_train, hypara=hypara)
-valid_dataset = BBGDataset(listfile=source.file_valid, hypara=hypara) if args.dataloader == 'slow-HDD' else BBGDataset_fast(listfile=source.file_valid, hypara=hypara)
-train_loader = DataLoader(dataset=train_dataset, batch_size=1, shuffle=True)
-valid_loader = DataLoader(dataset=valid_dataset, batch_size=1, shuffle=True)
+if args.dataloader == 'fast-RAM':
+    options = {'nworkers': max(args.num_workers, 1), 'dir_cache': args.cache_dir}
+    train_dataset = BBGDataset_shared(listfile=source.file_train, hypara=hypara, sparse=True, **options)
+    valid_dataset = BBGDataset_shared(listfile=source.file_valid, hypara=hypara, sparse=True, **options)
+else:
+    datasets = {'slow-HDD': BBGDataset, 'shard': BBGDataset_shard}
+    train_dataset = datasets[args.dataloader](listfile=source.file_train, hypara=hypara, sparse=True)
+    valid_dataset = datasets[args.dataloader](listfile=source.file_valid, hypara=hypara, sparse=True)
+options = {'num_workers': args.num_workers, 'prefetch': args.prefetch, 'pin_memory': source.device.startswith('cuda')}
+train_loader = batch_loader(train_dataset, hypara.batchsize_cut, shuffle=True, **options)
+valid_loader = batch_loader(valid_dataset, hypara.batchsize_cut, shuffle=False, pad=False, **options)
 
 # loss function
 criterion = nn.CrossEntropyLoss().to(source.device)
 
 
-# training routine
-file = open(source.file_out, 'w')
+# training routine (output & parameters from rank 0)
+file = open(source.file_out, 'w') if main_process else open(os.devnull, 'w')
 file.write("# Total Parameters : {:.2f}M\n".format(params/1000000))
-for iepoch in range(epoch_init, hypara.nepoch):
-    loss_train, acc_train, loss_valid, acc_valid = float('inf'), 0, float('inf'), 0
-    # training
-    loss_train, acc_train = train(model, criterion, source, train_loader, optimizer, hypara)
-    # validation
-    loss_valid, acc_valid = valid(model, criterion, source, valid_loader)
-    scheduler.step()
-    file.write(' {epoch:3d}  LossTR: {loss_TR:.3f} AccTR: {acc_TR:.3f}  LossTS: {loss_TS:.3f} AccTS: {acc_TS:.3f}\n'
-                .format(epoch=iepoch, loss_TR=loss_train, acc_TR=acc_train, loss_TS=loss_valid, acc_TS=acc_valid))
-    file.flush()
-    # output params
-    torch.save(model, "{}-{:03d}.pkl".format(source.param_prefix, iepoch))
-    torch.save({
-        'epoch': iepoch,
-        'model_state_dict': model.to('cpu').state_dict(),
-        'optimizer_state_dict': optimizer.state_dict(),
-        'scheduler_state_dict': scheduler.state_dict(),
-        'loss': loss_train,
-        'hyperparams': hypara
-    }, "{}-{:03d}.ckp".format(source.param_prefix, iepoch))
-    model.to(source.device)
\ No newline at end of file
+try:
+    for iepoch in range(epoch_init, hypara.nepoch):
+        loss_train, acc_train, loss_valid, acc_valid = float('inf'), 0, float('inf'), 0
+        # training
+        train_loader.batch_sampler.set_epoch(iepoch)
+        loss_train, acc_train = train(model, criterion, source, train_loader, optimizer, hypara)
+        # validation (without gradient synchronization)
+        loss_valid, acc_valid = valid(net, criterion, source, valid_loader)
+        scheduler.step()
+        file.write(' {epoch:3d}  LossTR: {loss_TR:.3f} AccTR: {acc_TR:.3f}  LossTS: {loss_TS:.3f} AccTS: {acc_TS:.3f}\n'
+                    .format(epoch=iepoch, loss_TR=loss_train, acc_TR=acc_train, loss_TS=loss_valid, acc_TS=acc_valid))
+        file.flush()
+        # output params & checkpoint (written in background)
+        if not main_process: continue
+        writer.save(iepoch, net, optimizer, scheduler, hypara, loss_train, loss_valid)
+finally:
+    # the last write is completed (& its errors raised) also when the training fails
+    file.close()
+    if main_process:
+        writer.close()
+if distributed:
+    dist.destroy_process_group()
\ No newline at end of file
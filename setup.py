@@ -24,7 +24,7 @@ setup(
     use_scm_version={'local_scheme': 'no-local-version'},
 
     setup_requires=['setuptools_scm'],
-    install_requires=['numpy', 'pandas', 'torch', 'tqdm'],
+    install_requires=['numpy', 'torch', 'tqdm'],
  
     include_package_data=True,
     scripts=[
@@ -32,7 +32,11 @@ setup(
         'scripts/gcndesign_predict.py',
         'scripts/gcndesign_resfile.py',
         'scripts/gcndesign_training.py',
-        'scripts/gcndesign_pdb2csv.py'
+        'scripts/gcndesign_pdb2csv.py',
+        'scripts/gcndesign_export.py',
+        'scripts/gcndesign_evaluate.py',
+        'scripts/gcndesign_server.py',
+        'scripts/gcndesign_sample.py'
     ],
 
     classifiers=[